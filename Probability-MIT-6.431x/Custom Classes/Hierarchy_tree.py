@@ -2,13 +2,62 @@
 # coding: utf-8
 
 import networkx as nx
+import numpy as np
 import random
 
 import plotly.plotly as ply
 import plotly.graph_objs as go
 from plotly.offline import init_notebook_mode, iplot
 
-def build_nodeDict(elements,repeat,children):
+def combination_Sizes(elements,repeat):
+    '''
+    Helper function with the items and subtree sizes of the tree of combinations of 'elements'.
+    elements: string or list of ints or floats with the items to be combined.
+    repeat: int number of times to repeat the same item in the combination
+    
+    Returns a tuple (items, sizes). items is the list of the distinct items as strings 
+    and sizes[d] is the number of nodes in a subtree whose root is at level d.
+    '''
+    items = []
+    for x in elements: #Keep the first occurrence of each item
+        x = str(x)
+        if x not in items:
+            items.append(x)
+    
+    sizes = [1]*(repeat+1)
+    for d in range(repeat-1,-1,-1):
+        sizes[d] = 1 + len(items)*sizes[d+1]
+        
+    return items, sizes
+
+def iter_nodeDict(elements,repeat):
+    '''
+    Generator that streams the nodes of the tree of all the combinations of 'elements'
+    of length 1 to 'repeat', in the same order (preorder) and with the same keys as build_nodeDict().
+    The children of each node are derived from its key, so only the current path is kept in memory.
+    elements: string or list of ints or floats with the items to be combined. Repeated
+              items are used once.
+    repeat: int number of times to repeat the same item in the combination
+    
+    Yields tuples (key(int), node name(str), node children(list of int or None for the leaves)).
+    '''
+    items, sizes = combination_Sizes(elements,repeat)
+    b = len(items)
+    
+    stack = [(0,'',0)]
+    while stack:
+        key, name, d = stack.pop()
+        if d == repeat or b == 0:
+            yield key, name, None
+            continue
+        
+        children = [key + 1 + j*sizes[d+1] for j in range(b)]
+        yield key, name, children
+        
+        for j in range(b-1,-1,-1): #First child on top of the stack
+            stack.append((children[j], name + items[j], d + 1))
+
+def build_nodeDict(elements,repeat,children=None):
     '''
     Helper Funtion used to create a dictionary of nodes that can be used
     with the TreeGraph class below.
@@ -17,36 +66,51 @@ def build_nodeDict(elements,repeat,children):
     children: list of lists where each list contains the int reference of the
             children in a node. Node is referenced as the index of the outer list (node 0 = index 0).  
             If the node has no children, instead of a list a 'None' value is expected.
+            Default None derives the children of every node (see iter_nodeDict()).
     '''
-    from itertools import product
-    
     nodes = {}
     
-    combos = product(elements,repeat=repeat)
-    key = 0
-    used = []
-    for i in range(len(elements)**repeat): #The final branches of the tree have len(elements)^repeat results.
-
-        c = next(combos) #choose next item in the iterator
-        s = '' #Create each node as a string
-
-        for x in c: 
-            if type(x) != str:
-                x = str(x)
-            else:
-                if key == 0: #node 0 is the root, so it has no item associated with it.
-                    nodes[key] = ('',children[key])
-                    key +=1
-
-                s += x
-                if s not in used: #Avoid adding the same combination
-                    nodes[key] = (s,children[key])
-                    used.append(s)
-                    key +=1
-        s = ''#Reset s to empty for a new combo to be processed.
+    for key, name, child_keys in iter_nodeDict(elements,repeat):
+        nodes[key] = (name, child_keys if children == None else children[key])
         
     return nodes
 
+def extend_Trace(trace,prop,values):
+    '''
+    Helper function that appends an array of values to a plotly trace property with a 
+    single assignment (the trace is validated once, not once per value).
+    trace: plotly trace or dictionary, e.g. go.Scatter or trace['marker'].
+    prop: string, property name, e.g. 'x'.
+    values: numpy array with the new values.
+    '''
+    current = trace[prop]
+    if current is None or len(current) == 0:
+        trace[prop] = values
+    else:
+        trace[prop] = np.concatenate([np.asarray(current, dtype=values.dtype), values])
+
+def edge_Mapping(values,edges):
+    '''
+    Helper function that keys the edge weights or labels given to TreeGraph by (parent, child) tuples.
+    values: dictionary of edges by (parent, child) tuples or by the string str(parent)+str(child), or None.
+    edges: list of (parent, child) tuples of the tree.
+    
+    Returns a dictionary (parent, child)->value, or None if values is None.
+    '''
+    if values == None:
+        return None
+    
+    mapping = {}
+    for edge in edges:
+        if edge in values:
+            mapping[edge] = values[edge]
+        elif '%s%s' % edge in values:
+            mapping[edge] = values['%s%s' % edge]
+        else:
+            raise KeyError("No value given for edge %s." % (edge,))
+            
+    return mapping
+
 class TreeGraph:
     '''
     Hierarchical graph class using the networkx package (https://networkx.github.io/)  
@@ -55,7 +119,8 @@ class TreeGraph:
     '''
     
     def __init__(self,orientation='v', root=None, nodes={}, spread=0.3, gap=0.01, root_x=None, 
-                 root_y=None, edge_weights=None, edge_labels=None, pos=None, parent=None):
+                 root_y=None, edge_weights=None, edge_labels=None, pos=None, parent=None, layout='hierarchy',
+                 directed=False):
             '''
             orientation: string or None. Direction of the graph given as 'v'(vertical, 
                          top-down hierarchy) or 'h'(horizontal, left-right hierarchy)
@@ -71,7 +136,8 @@ class TreeGraph:
 
             nodes: dictionary of nodes by key(int)->(node name(str),node children(list)).
                    The keys need to follow a numerical order, where lowest int is the root and largest
-                   int is the furthest node.
+                   int is the furthest node. An iterable of (key, name, children) records, 
+                   as streamed by iter_nodeDict(), is also accepted.
             
             spread: horizontal or vertical space allocated for this branch - avoids overlap with other branches
 
@@ -81,21 +147,36 @@ class TreeGraph:
 
             root_y: vertical location of root
             
-            edge_weights: dictionary of edges where key is a string concatenating two nodes from nodes dict
+            edge_weights: dictionary of edges where key is a tuple with two nodes from nodes dict
                           and value is an integer with the edge's weight. 
-                          key(str(nodes[parent int])+str(nodes[child int]))->weight(int)
+                          key((parent int, child int))->weight(int)
+                          Keys concatenating the two nodes as a string, str(parent int)+str(child int),
+                          are also accepted, but they are ambiguous ('1'+'12' and '11'+'2').
+            
+            edge_labels: dictionary of edges where key is a tuple with two nodes from nodes dict
+                         key((parent int, child int))->label(str). String keys are also accepted.
             
-            edge_labels: dictionary of edges where key is a string concatenating two nodes from nodes dict
-                         key(str(nodes[parent int])+str(nodes[child int]))->label(str)
+            See also TreeGraph.from_Edges() to build a tree from arrays of edges.
             
             pos: a dict saying where all nodes go if they have been assigned
             parent: parent of this branch. - only affects it if non-directed
             
+            layout: string. 'hierarchy' divides the spread of each node evenly among its children.
+                    'tidy' packs the subtrees by their contours (Reingold-Tilford, with Walker's
+                    algorithm in linear time as given by Buchheim et al.), so every level uses
+                    the same spacing and the whole tree is 'spread' wide. Default 'hierarchy'.
+            
+            directed: bool. If True, self.G is a networkx DiGraph with the edges from parent to child
+                      and, if 'root' is not given, the root of the tree is used. Default False.
+            
             A networkx graph object, self.G, a tree, is created using the data in 'nodes'.
             '''
-            self.G = nx.Graph()
+            self.directed = directed
+            self.G = nx.DiGraph() if directed else nx.Graph()
             self.orientation = orientation
             self.root = root
+            if not isinstance(nodes, dict): #Records (key, name, children)
+                nodes = {key:(name,children) for key, name, children in nodes}
             self.nodes = nodes
             self.spread = spread
             self.gap = gap
@@ -110,36 +191,266 @@ class TreeGraph:
                 self.root_x = root_x
                 self.root_y = root_y
              
-            self.edge_weights = edge_weights
-            self.edge_labels = edge_labels
             self.pos = pos
             self.parent = parent
+            self.layout = layout
             
-            self.edge_list = [] #List of edges to add to networkx graph
+            self._pos_cache = None #Positions from the last hierarchy_pos() call
+            self._pos_key = None #Graph and settings used to compute _pos_cache
+            
+            edges = [(parent, child) for parent in self.nodes if self.nodes[parent][1] != None
+                     for child in self.nodes[parent][1]]
+            self.edge_weights = edge_Mapping(edge_weights, edges) #Keyed by (parent, child)
+            self.edge_labels = edge_Mapping(edge_labels, edges)
+            
+            names = [(self.nodes[parent][0], self.nodes[child][0]) for parent, child in edges]
+            if self.edge_weights != None: #List of edges to add to networkx graph
+                self.edge_list = [(a, b, self.edge_weights[edge]) for (a, b), edge in zip(names, edges)]
+            else:
+                self.edge_list = names
+                
             self.edge_Outlabels = {} #Dictionary of labels assigned to each edge
-            for parent in self.nodes:
-                try:
-                    for child in self.nodes[parent][1]:
-                        try:
-                            if self.edge_weights != None:
-                                self.edge_list.append((self.nodes[parent][0],self.nodes[child][0],
-                                                       self.edge_weights['%s%s'%(parent,child)]))
-                            else:
-                                self.edge_list.append((self.nodes[parent][0],self.nodes[child][0]))
-                                
-                            self.edge_Outlabels[(self.nodes[parent][0],self.nodes[child][0])] = \
-                            self.edge_labels['%s%s'%(parent,child)]
-                        except TypeError:
-                            continue
-                except TypeError:
-                            continue
+            if self.edge_labels != None:
+                self.edge_Outlabels = dict(zip(names, [self.edge_labels[edge] for edge in edges]))
             
             if self.edge_weights != None: #add weighted edges if provided
                 self.G.add_weighted_edges_from(self.edge_list)
            
             else: #add edges
                 self.G.add_edges_from(self.edge_list)
+                
+            self._build_Tree(edges)
+            if directed and self.root is None and len(self._keys) != 0: #Root fixed at construction
+                self.root = self.nodes[self._keys[0]][0]
+   
+    @classmethod
+    def from_Edges(cls, parent=None, child=None, weight=None, label=None, names=None, data=None, **kwargs):
+        '''
+        Build a TreeGraph from parallel arrays of edges, validated in bulk.
+        parent: array of int, key of the parent node of each edge.
+        child: array of int, key of the child node of each edge.
+        weight: array of float with the weight of each edge. Default None.
+        label: array of str with the label of each edge. Default None.
+        names: dictionary or array of the node names by key. Default is '' for the root
+               and str(key) for the other nodes.
+        data: pandas DataFrame or dictionary with columns 'parent', 'child' and optionally
+              'weight' and 'label', used instead of the arrays above.
+        kwargs: other TreeGraph parameters, e.g. orientation. 'root' defaults to the root name.
+        
+        Returns a TreeGraph.
+        '''
+        if data is not None:
+            parent, child = data['parent'], data['child']
+            weight = data['weight'] if 'weight' in data else weight
+            label = data['label'] if 'label' in data else label
+            
+        parent = np.asarray(parent)
+        child = np.asarray(child)
+        if parent.ndim != 1 or child.shape != parent.shape:
+            raise ValueError("parent and child must be 1-D arrays of the same length, shapes %s and %s given."
+                             % (parent.shape, child.shape))
+        
+        if weight is not None:
+            weight = np.asarray(weight, dtype=float)
+            if weight.shape != parent.shape:
+                raise ValueError("weight has %d items, %d edges given." % (weight.size, parent.size))
+            if not np.isfinite(weight).all():
+                raise ValueError("Edge weights must be finite, edges %s are not." 
+                                 % list(zip(parent[~np.isfinite(weight)][:10], child[~np.isfinite(weight)][:10])))
+        if label is not None:
+            label = np.asarray(label, dtype=object)
+            if label.shape != parent.shape:
+                raise ValueError("label has %d items, %d edges given." % (label.size, parent.size))
+        
+        keys, counts = np.unique(child, return_counts=True)
+        if (counts > 1).any():
+            raise ValueError("Nodes with more than one parent: %s" % keys[counts > 1][:10].tolist())
+        if (parent == child).any():
+            raise ValueError("Edges from a node to itself: %s" % parent[parent == child][:10].tolist())
+        roots = np.setdiff1d(parent, child)
+        if len(parent) != 0 and len(roots) != 1:
+            raise ValueError("A tree has one root, %d nodes without a parent found: %s" 
+                             % (len(roots), roots[:10].tolist()))
+        
+        keys = np.union1d(parent, child)
+        parent_id, child_id = np.searchsorted(keys, parent), np.searchsorted(keys, child) #Indexes in keys
+        root = np.searchsorted(keys, roots[0]).item() if len(roots) != 0 else None
+        order = np.argsort(parent_id, kind='stable') #Children grouped by parent, in the given order
+        keys = keys.tolist()
+        
+        if names is None:
+            node_names = [str(key) for key in keys]
+            if root != None:
+                node_names[root] = ''
+        else:
+            node_names = [names[key] for key in keys]
+        
+        parents, starts = np.unique(parent_id[order], return_index=True)
+        children = child[order].tolist()
+        ends = starts[1:].tolist() + [len(children)]
+        node_children = [None]*len(keys)
+        for i, start, end in zip(parents.tolist(), starts.tolist(), ends):
+            node_children[i] = children[start:end]
+        
+        if root != None:
+            kwargs.setdefault('root', node_names[root])
+        tree = cls(**kwargs) #Settings only, the tree is filled from the arrays below
+        tree.nodes = dict(zip(keys, zip(node_names, node_children)))
+        
+        #Edges in the order __init__ adds them: parent by parent, children in the given order
+        edges = list(zip(parent[order].tolist(), children))
+        parent_names = [node_names[i] for i in parent_id[order].tolist()]
+        child_names = [node_names[i] for i in child_id[order].tolist()]
+        edge_names = list(zip(parent_names, child_names))
+        tree.edge_weights = None if weight is None else dict(zip(edges, weight[order].tolist()))
+        tree.edge_labels = None if label is None else dict(zip(edges, label[order].tolist()))
+        tree.edge_Outlabels = {} if label is None else dict(zip(edge_names, label[order].tolist()))
+        
+        if weight is not None:
+            tree.edge_list = list(zip(parent_names, child_names, weight[order].tolist()))
+            tree.G.add_weighted_edges_from(tree.edge_list)
+        else:
+            tree.edge_list = edge_names
+            tree.G.add_edges_from(tree.edge_list)
+        
+        tree._set_Tree(keys, parent_id, child_id, 
+                       weight if weight is not None else np.full(len(parent), np.nan), root)
+        if len(tree._keys) != len(keys):
+            raise ValueError("The edges are not a tree, %d nodes are not connected to the root." 
+                             % (len(keys) - len(tree._keys)))
+        if tree.directed and tree.root is None and len(keys) != 0: #Root fixed at construction
+            tree.root = node_names[root]
+        
+        return tree
    
+    @property
+    def G(self):
+        '''
+        The networkx graph. A tree restored by load() builds it on first use.
+        '''
+        if self._G is None:
+            graph_key = self._graph_Key()
+            self._G = nx.DiGraph() if self.directed else nx.Graph()
+            names = [self.nodes[key][0] for key in self._keys]
+            parents = self._parent.tolist()
+            if self.edge_weights != None:
+                weights = self._weight.tolist()
+                self.edge_list = [(names[parents[i]], names[i], weights[i]) for i in range(1, len(names))]
+                self._G.add_weighted_edges_from(self.edge_list)
+            else:
+                self.edge_list = [(names[parents[i]], names[i]) for i in range(1, len(names))]
+                self._G.add_edges_from(self.edge_list)
+            if self._pos_key != None and self._pos_key[-1] == graph_key: #The saved layout is still valid
+                self._pos_key = self._pos_key[:-1] + (self._graph_Key(),)
+        return self._G
+    
+    @G.setter
+    def G(self, graph):
+        self._G = graph
+    
+    def _graph_Key(self):
+        '''
+        Helper method that identifies the graph in the layout cache key, without building
+        the graph of a tree restored by load().
+        '''
+        if self._G is None:
+            return ('saved', len(self._keys))
+        
+        return (id(self._G), self._G.number_of_nodes(), self._G.number_of_edges())
+    
+    def save(self,file,positions=True):
+        '''
+        Save the tree in NumPy .npz format: node keys, names, parent indexes, depths, subtree sizes
+        and edge weights and labels (breadth-first order), the TreeGraph settings and, if positions
+        is True, the positions of hierarchy_pos() (computed if they are not cached).
+        Node names and edge labels are saved as strings.
+        file: str or file object, e.g. 'tree.npz'.
+        positions: bool, store the layout so load() does not compute it again. Default True.
+        '''
+        import json
+        
+        names = [self.nodes[key][0] for key in self._keys]
+        arrays = dict(keys=np.array(self._keys, dtype=np.int64), 
+                      names=np.array([str(name) for name in names]),
+                      parent=self._parent, weight=self._weight, depth=self._depth, size=self._size)
+        
+        if self.edge_labels != None:
+            arrays['labels'] = np.array([''] + [str(self.edge_labels[(self._keys[p], key)]) for p, key 
+                                                in zip(self._parent[1:].tolist(), self._keys[1:])])
+        
+        config = dict(orientation=self.orientation, root=self.root, spread=self.spread, gap=self.gap,
+                      root_x=self.root_x, root_y=self.root_y, parent=self.parent, layout=self.layout, 
+                      directed=self.directed, weights=self.edge_weights != None, positions=positions)
+        if positions:
+            pos = self._layout()
+            arrays['xy'] = np.array([pos[name] for name in names], dtype=float).reshape(-1,2)
+            config['tidy_width'] = getattr(self, '_tidy_width', None)
+        
+        np.savez(file, config=np.array(json.dumps(config)), **arrays)
+    
+    @classmethod
+    def load(cls,file):
+        '''
+        Load a tree saved with save(). The tree arrays and, if saved, the layout are restored 
+        as they are, so neither hierarchy_pos() nor the networkx graph are computed again
+        (the graph is built the first time self.G is used).
+        file: str or file object, e.g. 'tree.npz'.
+        
+        Returns a TreeGraph.
+        '''
+        import json
+        
+        with np.load(file, allow_pickle=False) as data:
+            config = json.loads(str(data['config']))
+            data_keys, data_names = data['keys'], data['names']
+            keys, names = data_keys.tolist(), data_names.tolist()
+            parent = data['parent']
+            weight = data['weight']
+            depth = data['depth']
+            size = data['size']
+            labels = data['labels'].tolist() if 'labels' in data else None
+            xy = data['xy'] if 'xy' in data else None
+        
+        tree = cls.__new__(cls)
+        tree._G = None
+        for name in ('orientation','root','spread','gap','root_x','root_y','parent','layout','directed'):
+            setattr(tree, name, config[name])
+        tree.pos = None
+        
+        #Children are contiguous and in order in breadth-first order, so parent[1:] is sorted
+        parent_keys = np.asarray(data_keys)[parent[1:]].tolist() if len(keys) != 0 else []
+        parents, starts = np.unique(parent[1:], return_index=True)
+        ends = starts[1:].tolist() + [len(keys)-1]
+        children = dict.fromkeys(keys)
+        for i, start, end in zip(parents.tolist(), starts.tolist(), ends):
+            children[keys[i]] = keys[start+1:end+1]
+        tree.nodes = dict(zip(keys, zip(names, children.values())))
+        
+        edges = list(zip(parent_keys, keys[1:]))
+        tree.edge_weights = dict(zip(edges, weight[1:].tolist())) if config['weights'] else None
+        tree.edge_labels = dict(zip(edges, labels[1:])) if labels != None else None
+        tree.edge_Outlabels = {}
+        if labels != None:
+            parent_names = np.asarray(data_names)[parent[1:]].tolist()
+            tree.edge_Outlabels = dict(zip(zip(parent_names, names[1:]), labels[1:]))
+        
+        tree._keys = keys
+        tree._index = dict(zip(keys, range(len(keys))))
+        tree._parent = parent
+        tree._weight = weight
+        tree._depth = depth
+        tree._size = size
+        
+        tree._pos_cache, tree._pos_key = None, None
+        if xy is not None:
+            tree._pos_cache = dict(zip(names, zip(xy[:,0].tolist(), xy[:,1].tolist())))
+            tree._pos_bounds = (xy[:,0].min(), xy[:,0].max(), xy[:,1].min(), xy[:,1].max())
+            tree._tidy_width = config.get('tidy_width')
+            tree._pos_key = (tree.layout, tree.orientation, tree.spread, tree.gap, tree.root, tree.root_x, 
+                             tree.root_y, id(tree.pos), tree.parent, tree._graph_Key())
+        
+        return tree
+    
     def nx_Graph(self):
         '''
         Returns the networkx graph.
@@ -158,90 +469,436 @@ class TreeGraph:
         Licensed under Creative Commons Attribution-Share Alike 
 
         If the graph is a tree this will return the positions to plot this in a 
-        hierarchical layout.
+        hierarchical layout. The layout is cached and computed again only when the
+        graph, layout, orientation, spread, gap or root settings change.
         
         Returns the hierarchy positions for a vertical tree or a horizontal tree.
         '''
-
-        if not nx.is_tree(self.G): #NODES NAMES MUST BE ALL DIFFERENT or else it won't create a tree
-            raise TypeError('cannot use hierarchy_pos on a graph that is not a tree') 
-
+        return dict(self._layout())
+    
+    def _layout(self):
+        '''
+        Helper method of hierarchy_pos() that computes the layout if the cache is out of date.
+        
+        Returns the cached positions dictionary itself (not a copy).
+        '''
         if self.root is None:
-            if isinstance(self.G, nx.DiGraph):
+            if self.directed:
                 self.root = next(iter(nx.topological_sort(self.G)))  #allows back compatibility with nx version 1.11
             else:
                 self.root = random.choice(list(self.G.nodes))
 
-        def _hierarchy_pos(G, root, spread, gap, root_x, root_y, pos=None, parent=None):
+        if self.layout not in ('hierarchy','tidy'):
+            raise ValueError("layout must be 'hierarchy' or 'tidy', '%s' given." % self.layout)
+        
+        key = (self.layout, self.orientation, self.spread, self.gap, self.root, self.root_x, self.root_y,
+               id(self.pos), self.parent, self._graph_Key())
+        if self._pos_key != key: #Layout again only if the graph or its settings changed
+            if not nx.is_tree(self.G): #NODES NAMES MUST BE ALL DIFFERENT or else it won't create a tree
+                raise TypeError('cannot use hierarchy_pos on a graph that is not a tree') 
+
+            layout = self._tidy_pos if self.layout == 'tidy' else self._hierarchy_pos
+            self._pos_cache = layout(self.G, self.root, self.spread, self.gap, 
+                                     self.root_x, self.root_y, self.pos, self.parent)
+            self._pos_key = key
+            
+            xy = np.array(list(self._pos_cache.values()), dtype=float).reshape(-1,2)
+            self._pos_bounds = (xy[:,0].min(), xy[:,0].max(), xy[:,1].min(), xy[:,1].max())
+
+        return self._pos_cache
+
+    def _hierarchy_pos(self, G, root, spread, gap, root_x, root_y, pos=None, parent=None):
+        '''
+        Helper method with the layout of hierarchy_pos(), walking the tree with a stack
+        instead of recursion so deep trees are laid out in one linear pass.
+        Nodes are placed in the same (preorder) order as the recursive version.
+        '''
+        if self.orientation not in ('v','h'):
+            raise Exception("Not a valid command for variable orientation! \n\
+            A string is needed with the value 'v' for a vertical graph (top-down) or \n\
+            value 'h' for horizontal graph (left-right). Default is 'v'.")
+
+        pos = {} if pos is None else dict(pos)
+        directed = isinstance(G, nx.DiGraph)
+        stack = [(root, parent, spread, root_x, root_y)]
+
+        while stack:
+            node, parent, spread, x, y = stack.pop()
+            pos[node] = (x, y)
+
+            children = list(G.neighbors(node))
+            if not directed and parent is not None:
+                children.remove(parent)
+            if len(children) == 0:
+                continue
+
+            sp = spread/len(children) #sp divides the spread in all children
+            nextxV = x - spread/2 - sp/2
+            nextxH = y + spread/2 + sp/2
+            branch = []
+            for child in children:
+                if self.orientation == 'v':
+                    nextxV += sp #Next horizontal position for a Vertical graph
+                    branch.append((child, node, sp, nextxV, y-gap))
+                else:
+                    nextxH -= sp #Next horizontal position for a Horizontal graph
+                    branch.append((child, node, sp, x+gap, nextxH))
+            stack.extend(reversed(branch)) #First child on top of the stack
 
-            if pos is None:
-                pos = {root:(root_x, root_y)}
+        return pos
+    
+    def _build_Tree(self,edges=None):
+        '''
+        Helper method that stores the tree of 'nodes' as arrays in breadth-first order 
+        from the root (the node that is nobody's child). See _set_Tree().
+        edges: list of (parent, child) keys. Default None reads them from 'nodes'.
+        '''
+        if edges is None:
+            edges = [(parent, child) for parent in self.nodes if self.nodes[parent][1] != None
+                     for child in self.nodes[parent][1]]
+        
+        keys = list(self.nodes)
+        ids = dict(zip(keys, range(len(keys))))
+        n, m = len(keys), len(edges)
+        
+        parent = np.fromiter((ids[edge[0]] for edge in edges), dtype=np.int64, count=m)
+        child = np.fromiter((ids[edge[1]] for edge in edges), dtype=np.int64, count=m)
+        if self.edge_weights != None:
+            weight = np.fromiter((self.edge_weights[edge] for edge in edges), dtype=float, count=m)
+        else:
+            weight = np.full(m, np.nan)
+        
+        root = None
+        if n != 0:
+            is_child = np.zeros(n, dtype=bool)
+            is_child[child] = True
+            free = np.flatnonzero(~is_child)
+            root = free[0] if len(free) != 0 else ids[min(keys)]
+            
+        self._set_Tree(keys, parent, child, weight, root)
+    
+    def _set_Tree(self,keys,parent,child,weight,root):
+        '''
+        Helper method that walks the tree from the root in breadth-first order, in one linear pass
+        (wide levels are stepped with numpy, so deep trees do not pay a numpy call per level), and 
+        stores it as arrays indexed by that order: self._keys (node keys),
+        self._parent (index of the parent, -1 for the root), self._depth (level of the node, 0 
+        for the root) and self._weight (weight of the edge from the parent, nan if there are 
+        no edge weights) and self._size (number of nodes in the subtree of the node). 
+        self._index maps each node key to its index. Nodes not connected to the root are left out.
+        keys: list of the node keys.
+        parent, child: arrays of int, index in 'keys' of the two nodes of each edge.
+        weight: array of float, weight of each edge (nan if there are no edge weights).
+        root: int, index in 'keys' of the root, None if there are no nodes.
+        '''
+        n = len(keys)
+        order, parents, weights, sizes = [], [], [], []
+        if n != 0:
+            by_parent = np.argsort(parent, kind='stable') #Edges grouped by parent, in the given order
+            starts = np.searchsorted(parent[by_parent], np.arange(n+1))
+            seen = bytearray(n) #Shared with seen_array, for the narrow and the wide levels
+            seen_array = np.frombuffer(seen, dtype=bool)
+            seen[root] = True
+            starts_list, by_parent_list = starts.tolist(), by_parent.tolist()
+            child_list, weight_list = child.tolist(), weight.tolist()
+            
+            level = [int(root)]
+            order.append(level[0])
+            parents.append(-1)
+            weights.append(np.nan)
+            sizes.append(1)
+            count = 1
+            while level:
+                first_pos = count - len(level) #Index of the first node of this level in breadth-first order
+                if len(level) < 256: #Narrow level, one edge at a time
+                    next_level = []
+                    for pos, node in enumerate(level, first_pos):
+                        for e in by_parent_list[starts_list[node]:starts_list[node+1]]:
+                            c = child_list[e]
+                            if not seen[c]: #Not a tree, keep the first parent found
+                                seen[c] = True
+                                next_level.append(c)
+                                parents.append(pos)
+                                weights.append(weight_list[e])
+                else: #Wide level, vectorized
+                    level = np.array(level)
+                    degree = starts[level+1] - starts[level]
+                    total = degree.sum()
+                    first = np.repeat(starts[level] - np.cumsum(degree) + degree, degree) + np.arange(total)
+                    e = by_parent[first] #Edges of this level, parent by parent
+                    e_parent = np.repeat(first_pos + np.arange(len(level)), degree)
+                    
+                    keep = ~seen_array[child[e]]
+                    e, e_parent = e[keep], e_parent[keep]
+                    keep = np.sort(np.unique(child[e], return_index=True)[1])
+                    e, e_parent = e[keep], e_parent[keep]
+                    
+                    seen_array[child[e]] = True
+                    next_level = child[e].tolist()
+                    parents.extend(e_parent.tolist())
+                    weights.extend(weight[e].tolist())
+                
+                level = next_level
+                order.extend(level)
+                if level:
+                    sizes.append(len(level))
+                count += len(level)
+        
+        self._keys = [keys[i] for i in order]
+        self._index = dict(zip(self._keys, range(len(order))))
+        self._parent = np.array(parents, dtype=np.int64)
+        self._weight = np.array(weights, dtype=float)
+        self._depth = np.repeat(np.arange(len(sizes)), sizes)
+        self._size = self._subtree_Sizes() #Nodes in the subtree of each node, one bottom-up pass
+    
+    def _tidy_pos(self, G, root, spread, gap, root_x, root_y, pos=None, parent=None):
+        '''
+        Helper method with the tidy layout of hierarchy_pos(). The first walk (post-order) 
+        places every subtree as close as its contours allow, one unit between siblings, and
+        the second walk (preorder) adds the modifiers. Both walks use stacks instead of recursion.
+        Coordinates are scaled so the tree is 'spread' wide, with levels 'gap' apart.
+        Also stores the width of the tree in units in self._tidy_width.
+        '''
+        if self.orientation not in ('v','h'):
+            raise Exception("Not a valid command for variable orientation! \n\
+            A string is needed with the value 'v' for a vertical graph (top-down) or \n\
+            value 'h' for horizontal graph (left-right). Default is 'v'.")
+        
+        #Nodes numbered as found, the children of a node together, with their parent and sibling number (1-based)
+        names, children, up, number, depth = [root], {}, [-1], [1], [0]
+        directed = isinstance(G, nx.DiGraph)
+        stack = [(0, parent)]
+        while stack:
+            v, prev = stack.pop()
+            kids = [n for n in G.neighbors(names[v]) if directed or n != prev]
+            first = len(names)
+            for i, n in enumerate(kids):
+                names.append(n)
+                up.append(v)
+                number.append(i+1)
+                depth.append(depth[v]+1)
+            children[v] = list(range(first, first+len(kids)))
+            stack.extend((first+i, names[v]) for i in range(len(kids)-1,-1,-1))
+        
+        n = len(names)
+        prelim, mod, shift, change = [0.]*n, [0.]*n, [0.]*n, [0.]*n
+        thread, ancestor = [None]*n, list(range(n))
+        
+        def left_sibling(v):
+            return None if number[v] == 1 else children[up[v]][number[v]-2]
+        
+        def next_left(v):
+            return children[v][0] if children[v] else thread[v]
+        
+        def next_right(v):
+            return children[v][-1] if children[v] else thread[v]
+        
+        def move_subtree(wl, wr, amount):
+            subtrees = number[wr] - number[wl]
+            change[wr] -= amount/subtrees
+            shift[wr] += amount
+            change[wl] += amount/subtrees
+            prelim[wr] += amount
+            mod[wr] += amount
+        
+        def apportion(v, default):
+            w = left_sibling(v)
+            if w is None:
+                return default
+            vir = vor = v
+            vil, vol = w, children[up[v]][0]
+            sir = sor = mod[v]
+            sil, sol = mod[vil], mod[vol]
+            while next_right(vil) is not None and next_left(vir) is not None:
+                vil, vir = next_right(vil), next_left(vir)
+                vol, vor = next_left(vol), next_right(vor)
+                ancestor[vor] = v
+                amount = (prelim[vil] + sil) - (prelim[vir] + sir) + 1
+                if amount > 0:
+                    a = ancestor[vil] if up[ancestor[vil]] == up[v] else default
+                    move_subtree(a, v, amount)
+                    sir += amount
+                    sor += amount
+                sil += mod[vil]
+                sir += mod[vir]
+                sol += mod[vol]
+                sor += mod[vor]
+            if next_right(vil) is not None and next_right(vor) is None:
+                thread[vor] = next_right(vil)
+                mod[vor] += sil - sor
+            if next_left(vir) is not None and next_left(vol) is None:
+                thread[vol] = next_left(vir)
+                mod[vol] += sir - sol
+                default = v
+            return default
+        
+        default = {} #Default ancestor of the children of each node
+        stack = [[0, 0]]
+        while stack: #First walk, post-order
+            v, i = stack[-1]
+            if i < len(children[v]):
+                if i == 0:
+                    default[v] = children[v][0]
+                stack[-1][1] += 1
+                stack.append([children[v][i], 0])
+                continue
+            stack.pop()
+            
+            w = left_sibling(v)
+            if children[v]:
+                amount = change_sum = 0. #Execute the shifts of the children
+                for c in reversed(children[v]):
+                    prelim[c] += amount
+                    mod[c] += amount
+                    change_sum += change[c]
+                    amount += shift[c] + change_sum
+                midpoint = (prelim[children[v][0]] + prelim[children[v][-1]])/2
+                if w is not None:
+                    prelim[v] = prelim[w] + 1
+                    mod[v] = prelim[v] - midpoint
+                else:
+                    prelim[v] = midpoint
+            elif w is not None:
+                prelim[v] = prelim[w] + 1
+            
+            if stack:
+                p = stack[-1][0]
+                default[p] = apportion(v, default[p])
+        
+        x = [0.]*n
+        stack = [(0, 0.)]
+        while stack: #Second walk, preorder
+            v, m = stack.pop()
+            x[v] = prelim[v] + m
+            stack.extend((c, m + mod[v]) for c in children[v])
+        
+        width = max(x) - min(x)
+        self._tidy_width = int(round(width)) + 1
+        scale = spread/width if width > 0 else 1.
+        
+        pos = {} if pos is None else dict(pos)
+        for v in range(n):
+            offset = (x[v] - x[0])*scale
+            if self.orientation == 'v':
+                pos[names[v]] = (root_x + offset, root_y - depth[v]*gap)
             else:
-                pos[root] = (root_x, root_y)
-            children = list(G.neighbors(root))
-            if not isinstance(G, nx.DiGraph) and parent is not None:
-                children.remove(parent)  
-            if len(children)!=0:
-                sp = spread/len(children) #sp divides the spread in all children
-                nextxV = root_x - spread/2 - sp/2
-                nextxH = root_y + spread/2 + sp/2
-                for child in children:
-                    if self.orientation == 'v':
-                        nextxV += sp #Next horizontal position for a Vertical graph
-                        pos = _hierarchy_pos(G,child, spread=sp, gap=gap, 
-                                            root_x=nextxV,root_y=root_y-gap,
-                                            pos=pos, parent = root)
-                    elif self.orientation == 'h':
-                        nextxH -= sp #Next horizontal position for a Horizontal graph
-                        pos = _hierarchy_pos(G,child, spread=sp, gap=gap, 
-                                             root_y=nextxH,root_x=root_x+gap,
-                                             pos=pos, parent = root)
-                    else:
-                        raise Exception("Not a valid command for variable orientation! \n\
-                        A string is needed with the value 'v' for a vertical graph (top-down) or \n\
-                        value 'h' for horizontal graph (left-right). Default is 'v'.")
-            return pos
-
-        return _hierarchy_pos(self.G, self.root, self.spread, self.gap, 
-                              self.root_x, self.root_y, self.pos, self.parent)
+                pos[names[v]] = (root_x + depth[v]*gap, root_y - offset)
+                
+        return pos
     
     def get_MaxLevels(self):
         '''
         Returns an int representing the maximun number of levels of hierarchy following
         the longest path of the Tree, from root to furthest node.
         '''
-        depth=None
-        for p in nx.all_simple_paths(self.G,#returns a path from source to destination
-                                     list(self.G.nodes)[0],
-                                     list(self.G.nodes)[-1]):
-            depth = p
+        if len(self._keys) == 0:
+            return 0
+        
+        return int(self._depth.max()) + 1
     
-        return len(depth)
+    def get_Depth(self,node):
+        '''
+        Returns the level of a node (int), 0 for the root.
+        node: An integer, the node as the key given in the 'nodes' dictionary.
+        '''
+        return int(self._depth[self._index[node]])
+    
+    def get_Parent(self,node):
+        '''
+        Returns the key of the parent of a node, None for the root.
+        node: An integer, the node as the key given in the 'nodes' dictionary.
+        '''
+        parent = self._parent[self._index[node]]
+        
+        return None if parent < 0 else self._keys[parent]
+    
+    def get_Ancestors(self,node):
+        '''
+        Returns a list with the keys of all the ancestors of a node, from its parent up to the root.
+        node: An integer, the node as the key given in the 'nodes' dictionary.
+        '''
+        ancestors = []
+        i = self._parent[self._index[node]]
+        while i >= 0:
+            ancestors.append(self._keys[i])
+            i = self._parent[i]
+            
+        return ancestors
+    
+    def is_Ancestor(self,ancestor,node):
+        '''
+        Returns True if 'ancestor' is on the path from the root to 'node' (a node is not its own ancestor).
+        ancestor, node: Integers, nodes as the keys given in the 'nodes' dictionary.
+        '''
+        a, i = self._index[ancestor], self._index[node]
+        if self._depth[a] >= self._depth[i]:
+            return False
+        while self._depth[i] > self._depth[a]:
+            i = self._parent[i]
+            
+        return i == a
+    
+    def get_CommonAncestor(self,source,target):
+        '''
+        Returns the key of the lowest common ancestor of two nodes.
+        source, target: Integers, nodes as the keys given in the 'nodes' dictionary.
+        '''
+        return self._keys[self._walk_Path(source,target)[0]]
+    
+    def _walk_Path(self,source,target):
+        '''
+        Helper method that climbs from both nodes up to their lowest common ancestor.
+        
+        Returns (index of the common ancestor, list of the indexes of the nodes on the 
+        path whose edge to their parent is part of the path).
+        '''
+        i, j = self._index[source], self._index[target]
+        edges = []
+        while self._depth[i] > self._depth[j]:
+            edges.append(i)
+            i = self._parent[i]
+        while self._depth[j] > self._depth[i]:
+            edges.append(j)
+            j = self._parent[j]
+        while i != j:
+            edges.extend((i,j))
+            i, j = self._parent[i], self._parent[j]
+            
+        return i, edges
     
     def get_Descendants(self):
         '''
         Returns a set with all descendants of the Tree's root.
         '''      
-        return nx.descendants(self.G,self.nodes[0][0])       
+        return set(self.nodes[key][0] for key in self._keys[1:])
+    
+    def count_Descendants(self,node=None):
+        '''
+        Returns the number of descendants of a node (int), from the subtree sizes
+        computed at construction.
+        node: An integer, the node as the key given in the 'nodes' dictionary. Default None is the root.
+        '''
+        if len(self._keys) == 0:
+            return 0
+        
+        return int(self._size[0 if node == None else self._index[node]]) - 1
     
     def get_PlotLayoutAxisInf(self):
         '''
         Gets the Layout axis information to accommodate the graph in a 
         proper x and y position when plotting. Returns a dictionary.
         '''
-        pos = self.hierarchy_pos().values()
-        x_values = [v[0] for v in pos]
-        y_values = [v[1] for v in pos]
+        x_min, x_max, y_min, y_max = self._layout_Bounds()
         
         if self.orientation == 'v':
-            xRange = [min(x_values)-0.09, max(x_values)+0.09]
-            yRange = [min(y_values)-0.006, max(y_values)]
+            xRange = [x_min-0.09, x_max+0.09]
+            yRange = [y_min-0.006, y_max]
             height = self.get_MaxLevels()*99 #height in pixels for the vertical plot space.
-            width = len(self.get_Descendants())*133 #width in pixels for the vertical plot space.
+            width = self._layout_Slots()*133 #width in pixels for the vertical plot space.
         else:
-            xRange = [min(x_values)-0.01, max(x_values)+0.45]
-            yRange = [min(y_values)-0.1, max(y_values)+0.1]
-            height = len(self.get_Descendants())*66 #height in pixels for the horizontal plot space.
+            xRange = [x_min-0.01, x_max+0.45]
+            yRange = [y_min-0.1, y_max+0.1]
+            height = self._layout_Slots()*66 #height in pixels for the horizontal plot space.
             width = self.get_MaxLevels()*300 #width in pixels for the horizontal plot space.
             
         x_axis = dict(range=xRange, showgrid=False, zeroline=False, showticklabels=False)
@@ -249,6 +906,26 @@ class TreeGraph:
         
         return {'x_axis':x_axis, 'y_axis':y_axis, 'height':height, 'width':width}
     
+    def _layout_Slots(self):
+        '''
+        Helper method with the number of node positions across the tree used to size the plot:
+        the width of the tidy layout in sibling distances, or the number of descendants.
+        '''
+        if self.layout == 'tidy':
+            self._layout() #Computes the tidy width if the layout is not cached
+            return self._tidy_width
+        
+        return self.count_Descendants()
+    
+    def _layout_Bounds(self):
+        '''
+        Helper method with the bounds (x_min, x_max, y_min, y_max) of the node positions, 
+        stored with the cached layout of hierarchy_pos().
+        '''
+        self._layout()
+            
+        return self._pos_bounds
+    
     def edge_midpoint(self,nStart,nEnd):      
         '''
         Returns the midpoint of a given edge given its start -> end nodes.
@@ -268,16 +945,28 @@ class TreeGraph:
         
         Adds data to the plotly traces. Traces have to be created prior using plotly.
         '''
-        for node in self.G.nodes():
-            x, y = pos[node]
-            if node == '':
-                root_trace['x'] += tuple([x])
-                root_trace['y'] += tuple([y])
-            else:        
-                node_trace['x'] += tuple([x])
-                node_trace['y'] += tuple([y])
-                node_trace['text']+=tuple([node])
-                node_trace['marker']['color']+=tuple([node_Mcolor])
+        nodes = list(self.G.nodes())
+        xy = np.array([pos[node] for node in nodes], dtype=float).reshape(-1,2)
+        is_root = np.array([node == '' for node in nodes], dtype=bool)
+        
+        text = np.empty(len(nodes), dtype=object) #Node names as given, not converted by numpy
+        text[:] = nodes
+        
+        previous = 0 if node_trace['x'] is None else len(node_trace['x']) #Nodes already in node_trace
+        colors = node_trace['marker']['color']
+        
+        extend_Trace(root_trace, 'x', xy[is_root,0])
+        extend_Trace(root_trace, 'y', xy[is_root,1])
+        extend_Trace(node_trace, 'x', xy[~is_root,0])
+        extend_Trace(node_trace, 'y', xy[~is_root,1])
+        extend_Trace(node_trace, 'text', text[~is_root])
+        
+        if previous == 0 or colors is None or (isinstance(colors,str) and colors == node_Mcolor):
+            node_trace['marker']['color'] = node_Mcolor #A single color for all the nodes is validated once
+        else:
+            if isinstance(colors,str):
+                node_trace['marker']['color'] = np.full(previous, colors, dtype=object)
+            extend_Trace(node_trace['marker'], 'color', np.full((~is_root).sum(), node_Mcolor, dtype=object))
             
     def edge_traces(self,pos,edge_trace):
         '''
@@ -287,16 +976,45 @@ class TreeGraph:
         
         Adds data to the plotly traces. Traces have to be created prior using plotly.
         '''
-        for edge in self.G.edges():
-            x0, y0 = pos[edge[0]]
-            x1, y1 = pos[edge[1]]
-            edge_trace['x'] += tuple([x0, x1, None])
-            edge_trace['y'] += tuple([y0, y1, None])
+        edges = list(self.G.edges())
+        x = np.full(3*len(edges), None, dtype=object) #x0, x1, None for each edge
+        y = np.full(3*len(edges), None, dtype=object)
+        
+        if len(edges) != 0:
+            start = np.array([pos[edge[0]] for edge in edges], dtype=float)
+            end = np.array([pos[edge[1]] for edge in edges], dtype=float)
+            x[0::3], x[1::3] = start[:,0], end[:,0]
+            y[0::3], y[1::3] = start[:,1], end[:,1]
+        
+        extend_Trace(edge_trace, 'x', x)
+        extend_Trace(edge_trace, 'y', y)
+            
+    def label_traces(self,pos,label_trace):
+        '''
+        Provides the information of a plotly trace for the edge labels, placed at the edge midpoints.
+        pos: position of nodes
+        label_trace: the edge label plotly trace settings
+        
+        Adds data to the plotly trace. The trace has to be created prior using plotly.
+        '''
+        edges = [edge for edge in self.edge_Outlabels if edge[0] in pos and edge[1] in pos]
+        text = np.empty(len(edges), dtype=object)
+        text[:] = [self.edge_Outlabels[edge] for edge in edges]
+        
+        mid = np.zeros((len(edges),2))
+        if len(edges) != 0:
+            mid = (np.array([pos[edge[0]] for edge in edges], dtype=float) +
+                   np.array([pos[edge[1]] for edge in edges], dtype=float))/2
+        
+        extend_Trace(label_trace, 'x', mid[:,0])
+        extend_Trace(label_trace, 'y', mid[:,1])
+        extend_Trace(label_trace, 'text', text)
             
     def paths_product(self,source,target):
         '''
         Return the product of a path from node 'source' to node 'target'
-        (Multiplies the weight of each edge).
+        (Multiplies the weight of each edge). The path goes up from both nodes to their
+        lowest common ancestor, in O(depth).
         
         source: An integer, the source node, as the key given in the 'nodes' dictionary.
         target: An integer, the target node, as the key given in the 'nodes' dictionary.
@@ -304,17 +1022,354 @@ class TreeGraph:
         Returns the product of all weights in the path.
         '''
         
-        path_edge_list = None
-        paths = nx.all_simple_paths(self.G,self.nodes[source][0],self.nodes[target][0])
-        for path in map(nx.utils.pairwise, paths):
-            path_edge_list = list(path)
-
+        if self.edge_weights == None:
+            raise ValueError("paths_product() needs the 'edge_weights' of the tree.")
+        
         product = 1
-        for edge in path_edge_list:
-            product *= self.G.get_edge_data(edge[0],edge[1])['weight']
+        for i in self._walk_Path(source,target)[1]: #Edges from each node on the path to its parent
+            product *= float(self._weight[i])
             
         return product
     
+    def path_Products(self):
+        '''
+        Product of the edge weights from the root to every node, computed top-down one 
+        level at a time (each level is a single vectorized product with its parents).
+        
+        Returns a numpy array aligned with the breadth-first order of the nodes (the root is 1).
+        '''
+        if self.edge_weights == None:
+            raise ValueError("path_Products() needs the 'edge_weights' of the tree.")
+            
+        products = np.ones(len(self._keys))
+        levels = np.searchsorted(self._depth, np.arange(self.get_MaxLevels()+1)) #Levels are contiguous
+        for start, end in zip(levels[1:-1], levels[2:]):
+            products[start:end] = products[self._parent[start:end]]*self._weight[start:end]
+            
+        return products
+    
+    def leaf_Probabilities(self,dataframe=False):
+        '''
+        Joint probability of every leaf, as the product of the edge weights from the root,
+        and the marginal sum of the probabilities of the nodes in each level.
+        dataframe: bool, if True return pandas objects. Default False.
+        
+        Returns a tuple (leaves, level_sums). leaves is a dictionary of arrays with the 
+        'key', 'name', 'depth' and 'probability' of each leaf (a DataFrame with those columns
+        if dataframe is True). level_sums is an array indexed by level (a Series if dataframe is True).
+        '''
+        products = self.path_Products()
+        
+        has_children = np.zeros(len(self._keys), dtype=bool)
+        has_children[self._parent[self._parent >= 0]] = True
+        leaves = np.flatnonzero(~has_children)
+        
+        table = dict(key=np.array([self._keys[i] for i in leaves]),
+                     name=np.array([self.nodes[self._keys[i]][0] for i in leaves], dtype=object),
+                     depth=self._depth[leaves],
+                     probability=products[leaves])
+        level_sums = np.bincount(self._depth, weights=products, minlength=self.get_MaxLevels())
+        
+        if dataframe:
+            import pandas as pd
+            
+            return pd.DataFrame(table), pd.Series(level_sums, name='probability').rename_axis('level')
+        
+        return table, level_sums
+    
+    def bayes_Inversion(self,order=None,outcomes=None,**kwargs):
+        '''
+        Bayes inversion of a probability tree whose levels are variables and whose edge weights
+        are the conditional probabilities of each outcome given the path above it (e.g. P(B|A)).
+        The joint distribution of all the leaves is computed in one vectorized pass, then 
+        reordered and conditioned again in the new level order.
+        order: tuple with the levels (1 to get_MaxLevels()-1) in the order of the inverted tree.
+               Default swaps the first two levels, e.g. (2, 1) to get P(A|B) from P(A) and P(B|A).
+        outcomes: dictionary of node key->outcome label of the node in its level. Nodes with the
+                  same label in a level are the same outcome. Default None uses the position of
+                  each node among its siblings (0, 1, ...) and labels 'L<level>=<position>'.
+        kwargs: other TreeGraph parameters for the inverted tree. Default uses the settings of this tree.
+        
+        Returns a dictionary with:
+            'joint': array of shape (outcomes of level 1, ..., outcomes of the last level) with the
+                     joint probabilities, in the level order of this tree.
+            'marginals': list with the marginal distribution (array) of the variable of each level.
+            'labels': list with the outcome labels of each level.
+            'conditionals': list where item i is the array P(level order[i] | levels order[:i]),
+                            with the axes in the new order.
+            'posteriors': the last array of 'conditionals'.
+            'tree': the inverted TreeGraph, with the conditionals as edge weights and edge labels.
+        '''
+        products = self.path_Products()
+        levels = self.get_MaxLevels() - 1
+        
+        has_children = np.zeros(len(self._keys), dtype=bool)
+        has_children[self._parent[self._parent >= 0]] = True
+        leaves = np.flatnonzero(~has_children)
+        if levels < 1 or (self._depth[leaves] != levels).any():
+            raise ValueError("bayes_Inversion() needs a tree with all its leaves on the last level.")
+        
+        #Outcome code of every node in its level
+        codes = np.zeros(len(self._keys), dtype=np.int64)
+        labels = []
+        bounds = np.searchsorted(self._depth, np.arange(levels+2)) #Levels are contiguous
+        for d in range(1, levels+1):
+            start, end = bounds[d], bounds[d+1]
+            if outcomes == None: #Position among siblings, which are contiguous and in order
+                parent = self._parent[start:end]
+                first = np.searchsorted(parent, parent) #Parents are sorted within a level
+                codes[start:end] = np.arange(end-start) - first
+                labels.append(['L%d=%d' % (d, j) for j in range(codes[start:end].max()+1)])
+            else:
+                level_labels = [outcomes[self._keys[i]] for i in range(start, end)]
+                unique = list(dict.fromkeys(level_labels)) #In order of first appearance
+                lookup = dict(zip(unique, range(len(unique))))
+                codes[start:end] = [lookup[label] for label in level_labels]
+                labels.append(unique)
+        
+        #Joint probabilities: outcomes of each leaf found climbing one level at a time
+        shape = tuple(len(l) for l in labels)
+        index = np.zeros((levels, len(leaves)), dtype=np.int64)
+        node = leaves
+        for d in range(levels, 0, -1):
+            index[d-1] = codes[node]
+            node = self._parent[node]
+        joint = np.zeros(shape)
+        np.add.at(joint, tuple(index), products[leaves])
+        
+        if order == None:
+            order = (2, 1) + tuple(range(3, levels+1)) if levels > 1 else (1,)
+        order = tuple(order)
+        if sorted(order) != list(range(1, levels+1)):
+            raise ValueError("order must have each level from 1 to %d once, %s given." % (levels, order))
+        
+        axes = [d-1 for d in order]
+        inverted = np.transpose(joint, axes)
+        marginals = [joint.sum(axis=tuple(a for a in range(levels) if a != d)) for d in range(levels)]
+        
+        conditionals = []
+        for i in range(1, levels+1):
+            prefix = inverted.sum(axis=tuple(range(i, levels))) if i < levels else inverted
+            above = prefix.sum(axis=-1, keepdims=True)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                conditionals.append(np.where(above > 0, prefix/np.where(above > 0, above, 1), 0.))
+        
+        #Inverted tree, one node per prefix of outcomes in the new order
+        new_labels = [labels[a] for a in axes]
+        nodes, edge_weights, edge_labels = {}, {}, {}
+        stack = [(0, (), '')]
+        key = 1
+        while stack:
+            node, path, name = stack.pop()
+            if len(path) == levels:
+                nodes[node] = (name, None)
+                continue
+            children = []
+            for j, label in enumerate(new_labels[len(path)]):
+                child_path = path + (j,)
+                weight = float(conditionals[len(path)][child_path])
+                edge_weights[(node, key)] = weight
+                edge_labels[(node, key)] = '%.4g' % weight
+                children.append((key, child_path, (name + ' ' + str(label)).strip()))
+                key += 1
+            nodes[node] = (name, [child[0] for child in children])
+            stack.extend(reversed(children))
+        
+        settings = dict(orientation=self.orientation, spread=self.spread, gap=self.gap, layout=self.layout,
+                        directed=self.directed, root='')
+        settings.update(kwargs)
+        tree = TreeGraph(nodes=nodes, edge_weights=edge_weights, edge_labels=edge_labels, **settings)
+        
+        return dict(joint=joint, marginals=marginals, labels=labels, conditionals=conditionals,
+                    posteriors=conditionals[-1], tree=tree)
+
+    def simulate(self,n=10**6,paths=False,batch=10**6,seed=None):
+        '''
+        Monte Carlo simulation of root-to-leaf paths, taking each child with the probability
+        of its edge weight (normalized among its siblings). The children of every node are
+        stored as one cumulative table, where the children of the r-th node with children
+        span (r, r+1], so each level of all the samples is drawn with a single np.searchsorted.
+        n: int, number of paths. Default 10^6.
+        paths: bool, if True return the full paths instead of the counts. Default False.
+        batch: int, number of paths drawn at once. Default 10^6.
+        seed: int, seed of the random generator. Default None.
+
+        Returns an integer array with the nodes as indexes in breadth-first order (self._keys
+        has their keys). If paths is False, the number of paths ending at each node (zero for
+        nodes with children). If paths is True, an array of shape (n, get_MaxLevels()) with
+        the node of each path in each level, -1 after its leaf.
+        '''
+        if self.edge_weights == None:
+            raise ValueError("simulate() needs the 'edge_weights' of the tree.")
+
+        weight = self._weight[1:] #Edges to the nodes 1, 2, ... in breadth-first order
+        if (weight < 0).any() or np.isnan(weight).any():
+            raise ValueError("simulate() needs non-negative edge weights.")
+
+        #Cumulative table: the children of a node are contiguous, grouped by parent in order
+        parent = self._parent[1:]
+        internal = np.zeros(len(self._keys), dtype=bool)
+        internal[parent] = True
+        rank = np.cumsum(internal) - 1.0 #Position of each node among the nodes with children
+
+        starts = np.flatnonzero(np.diff(parent, prepend=-1))
+        ends = np.append(starts[1:], len(parent))[:len(starts)] - 1
+        degree = ends - starts + 1
+        totals = np.repeat(np.add.reduceat(weight, starts), degree) if len(parent) != 0 else weight
+        even = np.repeat(1.0/degree, degree) #Equal chances if all the siblings have weight 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(totals > 0, weight/np.where(totals > 0, totals, 1), even)
+
+        table = np.cumsum(share)
+        table -= np.repeat(table[starts] - share[starts], degree) #Cumulative sum within siblings
+        table += rank[parent]
+        table[ends] = rank[parent[ends]] + 1 #The last sibling closes the span exactly
+
+        levels = self.get_MaxLevels()
+        bounds = np.searchsorted(self._depth, np.arange(levels+1)) - 1 #Table span of each level
+        rand = np.random.RandomState(seed)
+        counts = np.zeros(len(self._keys), dtype=np.int64)
+        if paths:
+            result = np.full((n, levels), -1, dtype=np.int64)
+            result[:, 0] = 0
+        drawn = 0
+
+        while drawn < n:
+            size = min(batch,n-drawn)
+            node = np.zeros(size, dtype=np.int64)
+            active = np.arange(size)
+            for d in range(1, levels):
+                active = active[internal[node[active]]] #Paths that have not reached a leaf
+                if len(active) == 0:
+                    break
+                draw = rank[node[active]] + rand.random_sample(len(active))
+                level = table[bounds[d]:bounds[d+1]] #Only the children of this level are searched
+                node[active] = np.searchsorted(level, draw, side='right') + bounds[d] + 1
+                if paths:
+                    result[drawn + active, d] = node[active]
+            if not paths:
+                counts += np.bincount(node, minlength=len(self._keys))
+            drawn += size
+
+        return result if paths else counts
+
+    def _subtree_Sizes(self):
+        '''
+        Helper method with the number of nodes in the subtree of every node (itself included),
+        as an array in breadth-first order, in one reverse pass (children come after their parent).
+        '''
+        sizes = [1]*len(self._keys)
+        parent = self._parent.tolist()
+        for i in range(len(parent)-1, 0, -1):
+            sizes[parent[i]] += sizes[i]
+            
+        return np.array(sizes, dtype=np.int64)
+    
+    def collapse(self,max_depth=None,min_mass=None,expand=()):
+        '''
+        Level-of-detail view of the tree. The children of each visible node that are deeper 
+        than 'max_depth' or have a probability mass (product of the weights from the root) 
+        below 'min_mass' are collapsed, with their subtrees, into a single aggregate node.
+        Only the visible part of the tree is walked, so the view costs what is shown, and the
+        visible nodes keep their positions from the (cached) layout of this tree.
+        max_depth: int, deepest level shown. Default None (no depth limit).
+        min_mass: float, smallest mass shown, needs 'edge_weights'. Default None (no mass limit).
+        expand: keys of the nodes whose children are always shown.
+        
+        Returns a TreeGraph with the same settings, where the aggregate nodes carry the sum of 
+        the weights of the collapsed edges. Its 'aggregates' dictionary maps each aggregate key to 
+        (key of its parent, tuple of the keys of the collapsed children), and expand_Aggregate()
+        returns the view with an aggregate expanded.
+        '''
+        if min_mass != None:
+            mass = self.path_Products()
+        subtree = self._size
+        expand = set(expand)
+        
+        nodes, aggregates = {}, {}
+        edge_weights = None if self.edge_weights == None else {}
+        edge_labels = None if self.edge_labels == None else {}
+        next_key = max(self._keys) + 1 #Aggregate keys follow the keys of the tree
+        
+        stack = [self._keys[0]]
+        while stack:
+            key = stack.pop()
+            children = self.nodes[key][1]
+            if children == None:
+                nodes[key] = (self.nodes[key][0], None)
+                continue
+            
+            shown, hidden = [], []
+            for child in children:
+                i = self._index[child]
+                if key in expand or ((max_depth == None or self._depth[i] <= max_depth) and
+                                     (min_mass == None or mass[i] >= min_mass)):
+                    shown.append(child)
+                else:
+                    hidden.append(child)
+            
+            for child in shown:
+                edge = (key, child)
+                if edge_weights != None:
+                    edge_weights[edge] = self.edge_weights[edge]
+                if edge_labels != None:
+                    edge_labels[edge] = self.edge_labels[edge]
+            
+            if len(hidden) != 0:
+                count = int(sum(subtree[self._index[child]] for child in hidden))
+                nodes[next_key] = ('%s[+%d]' % (self.nodes[key][0], count), None)
+                aggregates[next_key] = (key, tuple(hidden))
+                
+                edge = (key, next_key)
+                if edge_weights != None:
+                    edge_weights[edge] = sum(self.edge_weights[(key, child)] for child in hidden)
+                if edge_labels != None:
+                    edge_labels[edge] = '%.3g' % edge_weights[edge] if edge_weights != None else '+%d' % count
+                shown.append(next_key)
+                next_key += 1
+            
+            nodes[key] = (self.nodes[key][0], shown)
+            stack.extend(child for child in reversed(shown) if child not in aggregates)
+        
+        view = TreeGraph(orientation=self.orientation, root=self.nodes[self._keys[0]][0], nodes=nodes,
+                         spread=self.spread, gap=self.gap, root_x=self.root_x, root_y=self.root_y,
+                         edge_weights=edge_weights, edge_labels=edge_labels, layout=self.layout,
+                         directed=self.directed)
+        view.aggregates = aggregates
+        view._lod = (self, max_depth, min_mass, expand)
+        
+        #Visible nodes keep their positions from the layout of this tree, aggregates go to 
+        #the middle of the children they collapse
+        pos = self._layout()
+        view_pos = {nodes[key][0]:pos[self.nodes[key][0]] for key in nodes if key not in aggregates}
+        for key, (parent, hidden) in aggregates.items():
+            xy = np.array([pos[self.nodes[child][0]] for child in hidden], dtype=float)
+            view_pos[nodes[key][0]] = tuple(xy.mean(axis=0).tolist())
+        
+        xy = np.array(list(view_pos.values()), dtype=float).reshape(-1,2)
+        view._pos_cache = view_pos
+        view._pos_bounds = (xy[:,0].min(), xy[:,0].max(), xy[:,1].min(), xy[:,1].max())
+        view._tidy_width = getattr(self, '_tidy_width', None)
+        view._pos_key = (view.layout, view.orientation, view.spread, view.gap, view.root, view.root_x, 
+                         view.root_y, id(view.pos), view.parent, view._graph_Key())
+        
+        return view
+    
+    def expand_Aggregate(self,key):
+        '''
+        Expand an aggregate node of a view returned by collapse().
+        key: int, key of the aggregate node, as in the 'aggregates' dictionary.
+        
+        Returns a new view where the collapsed children of the aggregate are shown (their own 
+        children are collapsed again following the thresholds of the view).
+        '''
+        if not hasattr(self,'_lod'):
+            raise AttributeError("expand_Aggregate() is only available on a view returned by collapse().")
+        
+        source, max_depth, min_mass, expand = self._lod
+        
+        return source.collapse(max_depth, min_mass, expand | set([self.aggregates[key][0]]))
+    
     def G_custom_legend(self,xpos=None,ypos=None,names={},des_gap=0.02,vert_gap=0.13):
         '''
         Create a custom legend for the graph.
@@ -332,13 +1387,13 @@ class TreeGraph:
             names = {"[*]":"[Custom legend goes here,]",
                      "[**]":"[set using 'names' parameter]"}
         
-        vals = list(self.hierarchy_pos().values())
+        x_min, x_max, y_min, y_max = self._layout_Bounds()
         
         if self.orientation == 'v':
             
             if xpos == None and ypos == None:
-                xpos = min(list(zip(*vals))[0])-0.045 #zip is used to pair values from different lists. 
-                ypos = max(list(zip(*vals))[1]) #The * unzips the values.
+                xpos = x_min-0.045
+                ypos = y_max
 
             else:
                 xpos = xpos
@@ -346,8 +1401,8 @@ class TreeGraph:
             
         else:
             if xpos == None and ypos == None:
-                xpos = max(list(zip(*vals))[0])+0.15
-                ypos = max(list(zip(*vals))[1])/2
+                xpos = x_max+0.15
+                ypos = y_max/2
 
             else:
                 xpos = xpos
@@ -365,18 +1420,18 @@ class TreeGraph:
         return legend
 
 
-    def generic_plotly_plot(self, title, title_pos=0.05, height=None, width=None, notebook_mode=True,
-                            node_fontsize=12, legend=False,legend_labels=None,legnd_pos=None,
-                            leg_des_gap=0.02,leg_vert_gap=0.13, label_fontsize=11):
+    def build_figure(self, title, title_pos=0.05, height=None, width=None,
+                     node_fontsize=12, legend=False,legend_labels=None,legnd_pos=None,
+                     leg_des_gap=0.02,leg_vert_gap=0.13, label_fontsize=11, renderer='svg',
+                     max_label_nodes=5000):
         '''
-        Helper function with generic plotly settings for a basic plot using 
-        the TreeGraph() class instance settings.
+        Build a plotly figure with generic settings for a basic plot using 
+        the TreeGraph() class instance settings, without showing it.
 
         title: str with graph title.
         title_pos: float or int, move the title position along the x-axis
         height: int, Graph height in pixels. Default None.
         width: int, Graph width in pixels. Default None.
-        notebook_mode: bool, allow a plotly plot to be shown in a Jupyter Notebook.
         legend: bool, if True show legend using lagend_labels.
         legend_labels: dictionary of all legend symbol => symbol description. Default is None.
         legnd_pos: tuple(xval,yval)
@@ -384,9 +1439,18 @@ class TreeGraph:
         leg_vert_gap: float/int. Vertical gap between legend items. Default for horizontal tree is 0.13.
                       Recommended for vertical tree is 0.0009.
         label_fontsize: int/float fontsize for labels
+        renderer: str, 'svg' draws go.Scatter traces and the edge labels as annotations.
+                  'webgl' draws go.Scattergl traces and the edge labels as a text trace,
+                  for large trees. Default 'svg'.
+        max_label_nodes: int, with renderer 'webgl' and more nodes than this, the edge labels 
+                         are only shown on hover. Default 5000.
+        
+        Returns a plotly go.Figure.
         '''  
-
-        init_notebook_mode(connected=notebook_mode) #Allow plotly to plot inside notebook
+        if renderer not in ('svg','webgl'):
+            raise ValueError("renderer must be 'svg' or 'webgl', '%s' given." % renderer)
+            
+        Scatter = go.Scattergl if renderer == 'webgl' else go.Scatter
 
         layoutDefaults = self.get_PlotLayoutAxisInf() #Inserts height, width, xaxis and yaxis settings for graph.
 
@@ -397,16 +1461,18 @@ class TreeGraph:
              width = layoutDefaults['width']
 
 
-        edge_trace = go.Scatter(
+        edge_trace = Scatter(
             x=[],
             y=[],
             line=dict(width=0.9,color='#777'),
             text=[],
             mode='lines')
 
-        self.edge_traces(self.hierarchy_pos(),edge_trace) #Fill edge_trace
+        pos = self._layout() #Computed once (or cached) for all the traces and labels
 
-        root_trace = go.Scatter(
+        self.edge_traces(pos,edge_trace) #Fill edge_trace
+
+        root_trace = Scatter(
             x=[],
             y=[], 
             text=[],
@@ -416,7 +1482,7 @@ class TreeGraph:
                 color=[],
                 size=0))
 
-        node_trace = go.Scatter(
+        node_trace = Scatter(
             x=[],
             y=[], 
             text=[],
@@ -430,7 +1496,7 @@ class TreeGraph:
                 color=[],
                 size=70))
 
-        self.node_traces(self.hierarchy_pos(),root_trace,node_trace) #Fill root_trace and node_trace 
+        self.node_traces(pos,root_trace,node_trace) #Fill root_trace and node_trace 
 
         annotations = []
      
@@ -444,17 +1510,34 @@ class TreeGraph:
             for l in legend_function:
                 annotations.append(l) #add each element of the G_custom_legend() list to annotations.
                 
+        data = [root_trace,edge_trace, node_trace]
+        
         if self.edge_labels == None:
             annotations = None
+        elif renderer == 'webgl': #One text trace instead of an annotation per edge
+            hover_only = len(self._keys) > max_label_nodes
+            label_trace = go.Scattergl(
+                x=[],
+                y=[],
+                text=[],
+                textfont=dict(size=label_fontsize,color='#333'),
+                mode='markers' if hover_only else 'text',
+                hoverinfo='text',
+                showlegend=False,
+                marker=dict(size=6,opacity=0))
+            
+            self.label_traces(pos,label_trace) #Fill label_trace
+            data.append(label_trace)
         else:
+            edge_lbls = self.edge_lbls()
             for edge in self.nx_Graph().edges(): 
-                label = self.edge_midpoint(self.hierarchy_pos()[edge[0]],self.hierarchy_pos()[edge[1]])
-                annotations.append(dict(x=label[0],y=label[1],xref='x',yref='y',text=self.edge_lbls()[edge],
+                label = self.edge_midpoint(pos[edge[0]],pos[edge[1]])
+                annotations.append(dict(x=label[0],y=label[1],xref='x',yref='y',text=edge_lbls[edge],
                                        showarrow=True,borderpad=1,align='center',ax=3,ay=-5,arrowsize=1,arrowwidth=1,
                                        font=dict(size=label_fontsize,color='#333')))
 
 
-        fig = go.Figure(data=[root_trace,edge_trace, node_trace],
+        fig = go.Figure(data=data,
                         layout=go.Layout(
                         annotations=annotations,
                         hovermode='closest', #Show closest data on hover
@@ -468,7 +1551,271 @@ class TreeGraph:
                         xaxis= layoutDefaults['x_axis'],
                         yaxis= layoutDefaults['y_axis']))
 
-        iplot(fig)
+        return fig
+
+    def generic_plotly_plot(self, title, title_pos=0.05, height=None, width=None, notebook_mode=True,
+                            node_fontsize=12, legend=False,legend_labels=None,legnd_pos=None,
+                            leg_des_gap=0.02,leg_vert_gap=0.13, label_fontsize=11, renderer='svg',
+                            max_label_nodes=5000):
+        '''
+        Helper function with generic plotly settings for a basic plot using 
+        the TreeGraph() class instance settings.
+
+        notebook_mode: bool, allow a plotly plot to be shown in a Jupyter Notebook.
+        The other parameters are the same of build_figure().
+        '''  
+
+        init_notebook_mode(connected=notebook_mode) #Allow plotly to plot inside notebook
+
+        iplot(self.build_figure(title, title_pos=title_pos, height=height, width=width,
+                                node_fontsize=node_fontsize, legend=legend, legend_labels=legend_labels,
+                                legnd_pos=legnd_pos, leg_des_gap=leg_des_gap, leg_vert_gap=leg_vert_gap,
+                                label_fontsize=label_fontsize, renderer=renderer,
+                                max_label_nodes=max_label_nodes))
+
+
+def export_many(trees, fmt='html', workers=4, directory='.', **kwargs):
+    '''
+    Build and write the figures of many TreeGraph instances in parallel, without notebook mode.
+    The figures are written by a pool of threads, so static images share a single plotly.io 
+    (orca) engine, and HTML files share one plotly.min.js bundle written once in 'directory'.
+    trees: dictionary of file name(str)->TreeGraph, or list of TreeGraph (named 'tree_0', 'tree_1', ...).
+           The file name is also the title of the figure unless 'title' is given.
+    fmt: str, 'html', 'json' or a static image format supported by plotly.io.write_image
+         ('png', 'jpeg', 'webp', 'svg', 'pdf'). Default 'html'.
+    workers: int, number of threads. Default 4.
+    directory: str, output directory, created if needed. Default '.'.
+    kwargs: other parameters of TreeGraph.build_figure(), e.g. renderer='webgl'.
+    
+    Returns a list with the paths of the written files, in the order of 'trees'.
+    '''
+    import os
+    import plotly.io as pio
+    from concurrent.futures import ThreadPoolExecutor
+    
+    if not isinstance(trees, dict):
+        trees = dict(('tree_%d' % i, tree) for i, tree in enumerate(trees))
+        
+    os.makedirs(directory, exist_ok=True)
+    
+    if fmt == 'html':
+        bundle = os.path.join(directory, 'plotly.min.js')
+        if not os.path.exists(bundle): #Written once, before the threads start
+            from plotly.offline import get_plotlyjs
+            with open(bundle, 'w', encoding='utf-8') as f:
+                f.write(get_plotlyjs())
+        write = lambda fig, path: pio.write_html(fig, path, include_plotlyjs='directory', auto_open=False)
+    elif fmt == 'json':
+        write = pio.write_json
+    else:
+        write = lambda fig, path: pio.write_image(fig, path, format=fmt)
+        
+    title = kwargs.pop('title', None)
+
+    def export(name):
+        path = os.path.join(directory, '%s.%s' % (name, fmt))
+        write(trees[name].build_figure(name if title == None else title, **kwargs), path)
+        return path
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(export, list(trees)))
+
+
+class ImplicitTreeGraph:
+    '''
+    Regular tree of all the combinations of 'elements' of length 1 to 'repeat', with the same
+    keys as build_nodeDict(), where nothing is stored per node. Names, children, positions 
+    and path weights are computed on demand from the key in O(depth), so trees too large for
+    a TreeGraph can be queried, and any part of them can be rendered with to_TreeGraph().
+    '''
+    
+    def __init__(self, elements, repeat, weights=None, orientation='v', spread=0.3, gap=0.01,
+                 root_x=None, root_y=None):
+        '''
+        elements: string or list of ints or floats with the items to be combined
+        repeat: int number of levels below the root
+        weights: list with a weight for each item, used in every level, or list of 'repeat'
+                 lists with the weights of each level. Default None (no weights).
+        orientation, spread, gap, root_x, root_y: layout settings as in TreeGraph.
+        '''
+        self.elements = elements
+        self.repeat = repeat
+        self.items, self.sizes = combination_Sizes(elements,repeat)
+        self.orientation = orientation
+        self.spread = spread
+        self.gap = gap
+        
+        if root_x == None or root_y == None:
+            self.root_x, self.root_y = (0, 0.5) if orientation == 'h' else (0.5, 0)
+        else:
+            self.root_x, self.root_y = root_x, root_y
+        
+        if weights is None:
+            self.weights = None
+        else:
+            weights = np.asarray(weights,dtype=float)
+            if weights.shape == (len(self.items),):
+                weights = np.tile(weights,(repeat,1))
+            if weights.shape != (repeat,len(self.items)):
+                raise ValueError("weights must have %d items or shape (%d, %d), %s given." 
+                                 % (len(self.items),repeat,len(self.items),weights.shape))
+            self.weights = weights
+    
+    def __len__(self):
+        return self.sizes[0]
+    
+    def get_MaxLevels(self):
+        '''
+        Returns an int with the number of levels of hierarchy, root included.
+        '''
+        return self.repeat + 1
+    
+    def get_Path(self,key):
+        '''
+        Returns a list with the index of the item chosen at each level to reach node 'key'
+        (an empty list for the root).
+        '''
+        if not 0 <= key < self.sizes[0]:
+            raise KeyError(key)
+        
+        path = []
+        node = 0
+        while node != key:
+            size = self.sizes[len(path)+1]
+            j = (key - node - 1)//size
+            path.append(j)
+            node += 1 + j*size
+            
+        return path
+    
+    def get_Key(self,path):
+        '''
+        Returns the key of the node reached choosing the items with indexes 'path' (inverse of get_Path()).
+        '''
+        key = 0
+        for d, j in enumerate(path):
+            key += 1 + j*self.sizes[d+1]
+            
+        return key
+    
+    def get_Name(self,key):
+        '''
+        Returns the name of node 'key', the concatenation of its items.
+        '''
+        return ''.join(self.items[j] for j in self.get_Path(key))
+    
+    def get_Depth(self,key):
+        '''
+        Returns the level of node 'key', 0 for the root.
+        '''
+        return len(self.get_Path(key))
+    
+    def get_Children(self,key):
+        '''
+        Returns a list with the keys of the children of node 'key', None for the leaves.
+        '''
+        d = self.get_Depth(key)
+        if d == self.repeat or len(self.items) == 0:
+            return None
+        
+        return [key + 1 + j*self.sizes[d+1] for j in range(len(self.items))]
+    
+    def get_Parent(self,key):
+        '''
+        Returns the key of the parent of node 'key', None for the root.
+        '''
+        path = self.get_Path(key)
+        
+        return None if len(path) == 0 else self.get_Key(path[:-1])
+    
+    def get_Position(self,key):
+        '''
+        Returns the (x, y) position of node 'key' in the layout of TreeGraph.hierarchy_pos().
+        '''
+        x, y, spread = self.root_x, self.root_y, self.spread
+        for j in self.get_Path(key):
+            sp = spread/len(self.items)
+            if self.orientation == 'v':
+                x, y = x - spread/2 - sp/2 + (j+1)*sp, y - self.gap
+            else:
+                x, y = x + self.gap, y + spread/2 + sp/2 - (j+1)*sp
+            spread = sp
+            
+        return (x, y)
+    
+    def paths_product(self,source,target):
+        '''
+        Return the product of the weights of the edges in the path from node 'source' 
+        to node 'target', through their lowest common ancestor.
+        '''
+        if self.weights is None:
+            raise ValueError("paths_product() needs the 'weights' of the tree.")
+        
+        a, b = self.get_Path(source), self.get_Path(target)
+        common = 0
+        while common < min(len(a),len(b)) and a[common] == b[common]:
+            common += 1
+        
+        product = 1
+        for path in (a, b):
+            for d in range(common,len(path)):
+                product *= float(self.weights[d,path[d]])
+                
+        return product
+    
+    def leaf_Probability(self,key):
+        '''
+        Returns the product of the weights from the root to node 'key'.
+        '''
+        return self.paths_product(0,key)
+    
+    def iter_Nodes(self,key=0,max_depth=None):
+        '''
+        Generator with the (key, name, children) records of the subtree of node 'key' in 
+        preorder, as iter_nodeDict(). Nodes at level 'max_depth' are yielded as leaves.
+        '''
+        path = self.get_Path(key)
+        last = self.repeat if max_depth == None else min(max_depth,self.repeat)
+        
+        stack = [(key, ''.join(self.items[j] for j in path), len(path))]
+        while stack:
+            key, name, d = stack.pop()
+            if d >= last or len(self.items) == 0:
+                yield key, name, None
+                continue
+            
+            children = [key + 1 + j*self.sizes[d+1] for j in range(len(self.items))]
+            yield key, name, children
+            
+            for j in range(len(self.items)-1,-1,-1): #First child on top of the stack
+                stack.append((children[j], name + self.items[j], d + 1))
+    
+    def to_TreeGraph(self,max_depth=None,key=0,**kwargs):
+        '''
+        Materialize the subtree of node 'key' down to level 'max_depth' as a TreeGraph,
+        keeping the keys, positions and weights of this tree.
+        max_depth: int, last level included. Default None includes every level.
+        key: int, root of the subtree. Default 0, the root of the tree.
+        kwargs: other TreeGraph parameters, e.g. edge_labels.
+        
+        Returns a TreeGraph.
+        '''
+        nodes = dict((k,(name,children)) for k, name, children in self.iter_Nodes(key,max_depth))
+        
+        edge_weights = None
+        if self.weights is not None:
+            edge_weights = {}
+            for parent in nodes:
+                if nodes[parent][1] != None:
+                    d = self.get_Depth(parent)
+                    for j, child in enumerate(nodes[parent][1]):
+                        edge_weights[(parent,child)] = float(self.weights[d,j])
+        
+        root_x, root_y = self.get_Position(key)
+        
+        return TreeGraph(orientation=self.orientation, root=nodes[key][0], nodes=nodes,
+                         spread=self.spread/len(self.items)**self.get_Depth(key), gap=self.gap,
+                         root_x=root_x, root_y=root_y, edge_weights=edge_weights, **kwargs)
 
         
 # EXAMPLE OF TreeGraph INSTANCE PROVIDING NODES AND EDGE LABELS
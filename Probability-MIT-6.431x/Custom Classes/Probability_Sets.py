@@ -8,46 +8,880 @@ import matplotlib.pyplot as plt
 
 import numpy as np
 import shapely.geometry as sg
-from shapely.ops import cascaded_union,split
+from shapely.ops import unary_union,polygonize
+from shapely.prepared import prep
+from shapely.strtree import STRtree
 import shapely.affinity
 import descartes
 
-from itertools import combinations
-
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from functools import lru_cache
+import re
 import warnings
 
 
+class SpatialIndex():
+    '''
+    STRtree over a list of shapely figures plus a prepared geometry for each one,
+    so that spatial queries only test the candidates whose bounding boxes intersect.
+    '''
+    
+    def __init__(self,figures):
+        '''
+        figures: list, shapely geometries. Query results are indexes of this list.
+        '''
+        self.figures = list(figures)
+        self.prepared = [prep(f) for f in self.figures]
+        self.tree = STRtree(self.figures) if len(self.figures) != 0 else None
+        self._ids = {id(f):i for i,f in enumerate(self.figures)} #STRtree < 2.0 returns the geometries
+    
+    def candidates(self,geometry):
+        '''
+        Returns a sorted list with the indexes of the figures whose bounding box 
+        intersects the bounding box of geometry.
+        '''
+        if self.tree == None:
+            return []
+        return sorted(int(g) if isinstance(g,(int,np.integer)) else self._ids[id(g)]
+                      for g in self.tree.query(geometry))
+    
+    def containing(self,point):
+        '''
+        Returns a list with the indexes of the figures that contain the point.
+        '''
+        return [i for i in self.candidates(point) if self.prepared[i].contains(point)]
+    
+    def overlapping(self):
+        '''
+        Returns a list of index pairs (i,j), i<j, of the figures whose interiors intersect.
+        '''
+        pairs = []
+        for i, f in enumerate(self.figures):
+            for j in self.candidates(f):
+                if j > i and self.prepared[i].intersects(self.figures[j]) and \
+                   not self.prepared[i].touches(self.figures[j]):
+                    pairs.append((i,j))
+        return pairs
+
+
+def partition_Geometries(names,figures):
+    '''
+    Helper function that splits a group of overlapping figures into its atomic regions.
+    All the boundaries are overlaid once (noded union) and polygonized, then every
+    region is labeled with the figures that contain it.
+    names: list, names of the figures (events).
+    figures: list, shapely polygons in the same order as names.
+    
+    Returns a dictionary of partitions by key(int)->dict(part=polygon, text=str, events=tuple of names).
+    '''
+    
+    if len(figures) == 0:
+        return {}
+    
+    boundaries = unary_union([f.boundary for f in figures]) #Noded union of all boundaries
+    index = SpatialIndex(figures)
+    
+    partitions = {}
+    key = 1
+    
+    for region in polygonize(boundaries):
+        point = region.representative_point() #A point guaranteed to be inside the region
+        inside = tuple(names[i] for i in index.containing(point))
+        
+        if len(inside) != 0: #Regions outside every event (holes of the union) are not partitions
+            partitions[key] = dict(part=region, text='%s' % key, events=inside)
+            key += 1
+            
+    return partitions
+
+
+def _partition_Worker(job):
+    '''
+    Helper function run by the worker processes of compute_Partitions_many().
+    job: tuple (position, names, list of WKB bytes of the figures).
+    
+    Returns (position, list of (key, WKB bytes of the part, events)).
+    '''
+    from shapely import wkb
+    
+    position, names, figures = job
+    partitions = partition_Geometries(names,[wkb.loads(f) for f in figures])
+    
+    return position, [(key, wkb.dumps(p['part']), p['events']) for key, p in partitions.items()]
+
+
+_SET_TOKENS = re.compile(r'\s*(?:(\^c|[|&~()\-\\∪∩Ω])|"([^"]*)"|([A-Za-z_][\w.]*))')
+
+def parse_SetExpression(expr):
+    '''
+    Helper function that parses a set expression over event names into a nested tuple.
+    expr: string, e.g. 'A & (B | ~C)' or 'A ∩ B^c'. Supported operators are
+          union '|' or '∪', intersection '&' or '∩', difference '-' or '\\',
+          complement '~A' or 'A^c' and the whole space 'Omega' or 'Ω'.
+          Names with spaces or symbols can be written between double quotes.
+
+    Returns a tuple tree with the nodes ('event',name), ('omega',), ('not',x),
+    ('and',x,y), ('or',x,y) and ('diff',x,y).
+    '''
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        match = _SET_TOKENS.match(expr,pos)
+        if match == None:
+            raise ValueError("Invalid set expression '%s' at position %s." % (expr,pos))
+        op, quoted, name = match.groups()
+        if op != None:
+            tokens.append(op)
+        elif quoted == None and name == 'Omega':
+            tokens.append('Ω')
+        else:
+            tokens.append(('event',quoted if quoted != None else name))
+        pos = match.end()
+
+    def peek():
+        return tokens[0] if len(tokens) != 0 else None
+
+    def parse_union(): #Lowest precedence: union and difference, left to right
+        node = parse_inter()
+        while peek() in ('|','∪','-','\\'):
+            op = tokens.pop(0)
+            node = ('or' if op in ('|','∪') else 'diff', node, parse_inter())
+        return node
+
+    def parse_inter():
+        node = parse_unary()
+        while peek() in ('&','∩'):
+            tokens.pop(0)
+            node = ('and', node, parse_unary())
+        return node
+
+    def parse_unary():
+        tok = tokens.pop(0) if len(tokens) != 0 else None
+        if tok == '~':
+            node = ('not', parse_unary())
+        elif tok == '(':
+            node = parse_union()
+            if peek() != ')':
+                raise ValueError("Missing ')' in set expression '%s'." % expr)
+            tokens.pop(0)
+        elif tok == 'Ω':
+            node = ('omega',)
+        elif isinstance(tok,tuple):
+            node = tok
+        elif tok == None:
+            raise ValueError("Set expression '%s' ended unexpectedly." % expr)
+        else:
+            raise ValueError("Unexpected token '%s' in set expression '%s'." % (tok,expr))
+        while peek() == '^c': #Postfix complement
+            tokens.pop(0)
+            node = ('not', node)
+        return node
+
+    tree = parse_union()
+    if len(tokens) != 0:
+        tok = tokens[0][1] if isinstance(tokens[0],tuple) else tokens[0]
+        raise ValueError("Unexpected token '%s' in set expression '%s'." % (tok,expr))
+    return tree
+
+
+def expression_Events(tree):
+    '''
+    Helper function with the event names used in a parsed set expression.
+    tree: tuple tree returned by parse_SetExpression().
+
+    Returns a set of event names.
+    '''
+    names = set()
+    stack = [tree]
+    while len(stack) != 0:
+        node = stack.pop()
+        if node[0] == 'event':
+            names.add(node[1])
+        elif node[0] != 'omega':
+            stack.extend(node[1:])
+    return names
+
+
+def points_in_Polygon(x,y,polygon):
+    '''
+    Helper function for a vectorized even-odd test of many points against a polygon.
+    The loop runs over the polygon edges, never over the points.
+    x, y: numpy arrays with the point coordinates.
+    polygon: shapely Polygon or MultiPolygon, holes are taken into account.
+
+    Returns a boolean numpy array, True for the points inside the polygon.
+    '''
+    def in_ring(coords):
+        inside = np.zeros(np.shape(x),dtype=bool)
+        for (x0,y0),(x1,y1) in zip(coords[:-1],coords[1:]): #Rings are closed, last vertex = first vertex
+            if y0 == y1:
+                continue
+            crosses = (y0 > y) != (y1 > y)
+            inside ^= crosses & (x < x0 + (y - y0)*(x1 - x0)/(y1 - y0))
+        return inside
+
+    if hasattr(polygon,'geoms'):
+        inside = np.zeros(np.shape(x),dtype=bool)
+        for part in polygon.geoms:
+            inside |= points_in_Polygon(x,y,part)
+        return inside
+
+    inside = in_ring(np.asarray(polygon.exterior.coords))
+    for hole in polygon.interiors:
+        inside &= ~in_ring(np.asarray(hole.coords))
+    return inside
+
+
+def canonical_SetExpression(tree):
+    '''
+    Helper function that puts a parsed set expression in canonical form, so that
+    equivalent subexpressions share the same key (e.g. 'B & A' and 'A ∩ B').
+    Unions and intersections are flattened, deduplicated and sorted.
+    tree: tuple tree returned by parse_SetExpression().
+    
+    Returns a tuple (key, operation, operands) where operands is the event name
+    for 'event', None for 'omega', one canonical tuple for 'not', and a tuple of
+    canonical tuples for 'diff', 'and' and 'or'.
+    '''
+    op = tree[0]
+    
+    if op == 'event':
+        return ('"%s"' % tree[1], 'event', tree[1])
+    elif op == 'omega':
+        return ('Ω', 'omega', None)
+    elif op == 'not':
+        c = canonical_SetExpression(tree[1])
+        return ('~%s' % c[0], 'not', c)
+    elif op == 'diff':
+        a, b = canonical_SetExpression(tree[1]), canonical_SetExpression(tree[2])
+        return ('(%s-%s)' % (a[0],b[0]), 'diff', (a,b))
+    
+    flat = []
+    stack = [tree]
+    while len(stack) != 0: #Flatten chains of the same operation: A&(B&C) -> A&B&C
+        node = stack.pop()
+        if node[0] == op:
+            stack.extend(node[1:])
+        else:
+            flat.append(canonical_SetExpression(node))
+            
+    operands = tuple(sorted({c[0]:c for c in flat}.values()))
+    if len(operands) == 1: #A&A = A
+        return operands[0]
+    
+    return ('(%s)' % ('&' if op == 'and' else '|').join(c[0] for c in operands), op, operands)
+
+
+def rotate_Points(points,angle,origin):
+    '''
+    Helper function that rotates arrays of points counter-clockwise around an origin,
+    the same way shapely.affinity.rotate() does.
+    points: numpy array of shape (..., 2).
+    angle: float or numpy array broadcastable to points[...,0], rotation in degrees.
+    origin: tuple (x,y) or numpy array of shape (..., 2) with the rotation centers.
+    
+    Returns a numpy array with the rotated points.
+    '''
+    origin = np.asarray(origin,dtype=float)
+    cos_angle = np.cos(np.radians(angle))
+    sin_angle = np.sin(np.radians(angle))
+    
+    xc = points[...,0] - origin[...,0]
+    yc = points[...,1] - origin[...,1]
+    
+    return np.stack([origin[...,0] + xc*cos_angle - yc*sin_angle,
+                     origin[...,1] + xc*sin_angle + yc*cos_angle],axis=-1)
+
+
+def ellipse_Bounds(loc,width,height,angle):
+    '''
+    Helper function with the analytic bounding boxes of rotated ellipses.
+    loc: tuple (x,y) or numpy array of shape (n, 2) with the centers.
+    width, height, angle: floats or numpy arrays of shape (n,). Angles in degrees.
+    
+    Returns a numpy array of shape (..., 4) with (minx, miny, maxx, maxy).
+    '''
+    loc = np.asarray(loc,dtype=float)
+    cos_angle = np.cos(np.radians(angle))
+    sin_angle = np.sin(np.radians(angle))
+    
+    half_x = np.hypot(width*cos_angle,height*sin_angle) #Half extents of the rotated ellipse
+    half_y = np.hypot(width*sin_angle,height*cos_angle)
+    
+    return np.stack([loc[...,0]-half_x,loc[...,1]-half_y,loc[...,0]+half_x,loc[...,1]+half_y],axis=-1)
+
+
+@lru_cache(maxsize=64)
+def unit_Circle(res):
+    '''
+    Helper function with the cached template of a unit circle buffered with resolution
+    res (4*res segments, vertices on the circle). The array is read-only.
+    
+    Returns a numpy array of shape (4*res+1, 2).
+    '''
+    circle = np.asarray(sg.Point(0,0).buffer(1,res).exterior.coords)
+    circle.flags.writeable = False
+    return circle
+
+
+def ellipse_Resolution(max_error):
+    '''
+    Helper function with the smallest buffer resolution whose ellipse polygon has a
+    relative area error of at most max_error against the analytic area πab.
+    The polygon has N = 4*res vertices on the ellipse, so its area is 
+    πab*(N/2π)*sin(2π/N), an error close to 2π²/(3N²).
+    max_error: float, maximum relative area error, e.g. 1e-4.
+    
+    Returns an int resolution.
+    '''
+    from math import ceil, pi, sin, sqrt
+    
+    if not 0 < max_error < 1:
+        raise ValueError("max_error must be between 0 and 1, %s given." % max_error)
+    
+    res = max(1,int(ceil(pi*sqrt(2/(3*max_error))/4)) - 1)
+    while 1 - (4*res/(2*pi))*sin(2*pi/(4*res)) > max_error:
+        res += 1
+    return res
+
+
+def ellipse_Coords(loc,width,height,angle,res):
+    '''
+    Helper function with the polygon vertices of many ellipses at once: a unit circle 
+    buffered with resolution res, scaled by (width, height) and rotated around loc.
+    loc: numpy array of shape (n, 2) with the centers.
+    width, height, angle: numpy arrays of shape (n,). Angles in degrees.
+    res: int, resolution of the circle (4*res segments).
+    
+    Returns a numpy array of shape (n, vertices, 2).
+    '''
+    circle = unit_Circle(int(res))
+    loc = np.asarray(loc,dtype=float).reshape(-1,1,2)
+    axes = np.stack([np.ravel(width),np.ravel(height)],axis=-1)[:,None,:]
+    
+    return rotate_Points(circle[None,:,:]*axes,np.ravel(angle)[:,None],(0,0)) + loc
+
+
+def ellipse_Figure(loc,width,height,angle,res):
+    '''
+    Helper function that builds the polygon of one ellipse with ellipse_Coords().
+    
+    Returns a shapely Polygon.
+    '''
+    return sg.Polygon(ellipse_Coords([loc],width,height,angle,res)[0])
+
+
+class GridIndex():
+    '''
+    Uniform grid over Ω (the unit square) that maps the bounding boxes of keys to
+    buckets. Insertions, removals and queries only visit the buckets a box covers,
+    so their cost doesn't grow with the total number of keys.
+    '''
+    
+    def __init__(self,size=32):
+        '''
+        size: int, number of buckets per side. Boxes outside Ω go to the border buckets.
+        '''
+        self.size = size
+        self.buckets = {}
+        self.bounds = {}
+        
+    def _buckets(self,bounds):
+        clip = lambda v: min(max(int(np.floor(v*self.size)),0),self.size-1)
+        return [(i,j) for i in range(clip(bounds[0]),clip(bounds[2])+1) 
+                      for j in range(clip(bounds[1]),clip(bounds[3])+1)]
+        
+    def insert(self,key,bounds):
+        self.bounds[key] = bounds
+        for b in self._buckets(bounds):
+            self.buckets.setdefault(b,set()).add(key)
+            
+    def remove(self,key):
+        for b in self._buckets(self.bounds.pop(key)):
+            self.buckets[b].discard(key)
+            
+    def query(self,bounds):
+        '''
+        Returns a sorted list of the keys whose bounding box intersects bounds.
+        '''
+        keys = set()
+        for b in self._buckets(bounds):
+            keys.update(self.buckets.get(b,()))
+        return sorted(k for k in keys if self.bounds[k][0] <= bounds[2] and bounds[0] <= self.bounds[k][2] 
+                                     and self.bounds[k][1] <= bounds[3] and bounds[1] <= self.bounds[k][3])
+
+
+def polygon_Parts(geometry,min_area=1e-12):
+    '''
+    Helper function that returns the list of polygons in the result of a shapely
+    overlay, dropping lines, points and slivers smaller than min_area.
+    '''
+    if hasattr(geometry,'geoms'):
+        return [p for g in geometry.geoms for p in polygon_Parts(g,min_area)]
+    if geometry.geom_type == 'Polygon' and geometry.area > min_area:
+        return [geometry]
+    return []
+
+
+def polygons_Columns(points,angle):
+    '''
+    Helper function with the shoelace formula applied to many polygons in one pass.
+    The polygons are rotated around the center of their bounding box, as 
+    shapely.affinity.rotate() does.
+    points: list of numpy arrays of shape (vertices, 2), at least 3 vertices each.
+    angle: numpy array of shape (n,) with the rotations in degrees.
+    
+    Returns a tuple (columns, rotated) where columns is a dictionary of numpy arrays:
+    center (rotation origins), area, centroid (rotated), bounds (rotated) and 
+    text_loc (centroid before the rotation); and rotated is a list with the rotated vertices.
+    '''
+    counts = np.array([len(p) for p in points],dtype=int)
+    starts = np.concatenate([[0],np.cumsum(counts)[:-1]]).astype(int)
+    owner = np.repeat(np.arange(len(points)),counts) #Polygon of each vertex
+    flat = np.concatenate([np.asarray(p,dtype=float)[:,:2] for p in points])
+    angle = np.broadcast_to(np.asarray(angle,dtype=float),(len(points),))
+    
+    center = (np.minimum.reduceat(flat,starts) + np.maximum.reduceat(flat,starts))/2
+    
+    following = np.arange(len(flat)) + 1 #Next vertex of each vertex, closing every ring
+    following[starts + counts - 1] = starts
+    x, y = flat[:,0], flat[:,1]
+    xf, yf = x[following], y[following]
+    cross = x*yf - xf*y
+    
+    signed_area = np.add.reduceat(cross,starts)/2
+    degenerate = signed_area == 0
+    divisor = np.where(degenerate,1.,6*signed_area)
+    text_loc = np.stack([np.add.reduceat((x + xf)*cross,starts)/divisor,
+                         np.add.reduceat((y + yf)*cross,starts)/divisor],axis=-1)
+    text_loc[degenerate] = (np.add.reduceat(flat,starts)/counts[:,None])[degenerate] #Mean of the vertices
+    
+    rotated = rotate_Points(flat,angle[owner],center[owner])
+    
+    columns = dict(center=center, area=np.abs(signed_area), text_loc=text_loc,
+                   centroid=rotate_Points(text_loc,angle,center),
+                   bounds=np.concatenate([np.minimum.reduceat(rotated,starts),
+                                          np.maximum.reduceat(rotated,starts)],axis=1))
+    
+    return columns, np.split(rotated,starts[1:])
+
+
+def make_Polygons(coords):
+    '''
+    Helper function that builds one shapely Polygon per array of vertices, with the
+    vectorized constructor of shapely 2 when it is available.
+    
+    Returns a list of shapely Polygons.
+    '''
+    import shapely
+    
+    if hasattr(shapely,'polygons') and isinstance(coords,np.ndarray):
+        return list(shapely.polygons(coords))
+    return [sg.Polygon(c) for c in coords]
+
+
+def bulk_Arguments(data,arguments,defaults,pairs={}):
+    '''
+    Helper function that resolves the arguments of the Sets_Space bulk loaders.
+    Arguments left as None are read from the columns of data and then from defaults.
+    data: pandas DataFrame, dictionary of columns or None.
+    arguments: dictionary of argument name->value given by the caller.
+    defaults: dictionary of argument name->default value.
+    pairs: dictionary of argument name->(column x, column y) for the point arguments 
+           stored in two columns, e.g. loc=('x','y').
+    
+    Returns a dictionary of argument name->value.
+    '''
+    resolved = {}
+    for arg, value in arguments.items():
+        if value is None and data is not None:
+            column = 'name' if arg == 'names' else arg
+            if arg in pairs and pairs[arg][0] in data:
+                value = np.stack([np.asarray(data[pairs[arg][0]],dtype=float),
+                                  np.asarray(data[pairs[arg][1]],dtype=float)],axis=-1)
+            elif column in data:
+                value = list(data[column])
+        resolved[arg] = defaults.get(arg) if value is None else value
+    return resolved
+
+
+def bulk_Column(value,n,name):
+    '''
+    Helper function that broadcasts a bulk loader argument to one value per event.
+    Strings, tuples and scalars are shared by all the events, lists and arrays must
+    have one item per event.
+    
+    Returns a list with n items.
+    '''
+    if value is None or isinstance(value,(str,tuple)) or np.isscalar(value):
+        return [value]*n
+    value = list(value)
+    if len(value) != n:
+        raise ValueError("Argument '%s' has %s items, the batch has %s events." % (name,len(value),n))
+    return value
+
+
+def label_Collections(fig,ax,labels,text_box=None):
+    '''
+    Helper function that turns many text labels into one PathCollection, so that 
+    they are drawn in a single batch instead of one matplotlib Text per label.
+    fig, ax: matplotlib Figure and Axes of the plot.
+    labels: list of tuples (location in data coordinates, text, fontsize, color, 
+            horizontal alignment 'left', 'center' or 'right').
+    text_box: dictionary of the form dict(facecolor=matplotlib color, alpha=int) or None.
+              The boxes go in a second PathCollection drawn below the labels.
+    
+    Returns a list of PathCollections.
+    '''
+    from matplotlib.collections import PathCollection
+    from matplotlib.path import Path
+    from matplotlib.textpath import TextPath
+    from matplotlib.transforms import Affine2D
+    
+    paths, boxes, offsets, colors = [], [], [], []
+    shift = dict(left=0,center=0.5,right=1)
+    
+    for loc, text, fontsize, color, align in labels:
+        if text == None or text == '':
+            continue
+        path = TextPath((0,0),text,size=fontsize) #Outline in points, baseline at y=0
+        extents = path.get_extents()
+        dx = -extents.x0 - extents.width*shift[align]
+        paths.append(Path(path.vertices + (dx,0),path.codes))
+        
+        pad = 0.3*fontsize
+        x0, y0 = extents.x0 + dx - pad, extents.y0 - pad
+        x1, y1 = extents.x1 + dx + pad, extents.y1 + pad
+        boxes.append(Path([(x0,y0),(x1,y0),(x1,y1),(x0,y1),(x0,y0)],closed=True))
+        offsets.append((loc[0],loc[1]))
+        colors.append(color)
+        
+    #Paths are in points, scaled to pixels with the figure dpi, and placed at data offsets
+    transform = Affine2D().scale(1/72.) + fig.dpi_scale_trans
+    
+    def collection(collection_paths,**kwargs):
+        try:
+            return PathCollection(collection_paths,offsets=offsets,offset_transform=ax.transData,
+                                  transform=transform,**kwargs)
+        except (TypeError,AttributeError): #matplotlib < 3.6
+            return PathCollection(collection_paths,offsets=offsets,transOffset=ax.transData,
+                                  transform=transform,**kwargs)
+    
+    collections = []
+    if text_box != None and len(boxes) != 0:
+        collections.append(collection(boxes,facecolors=text_box.get('facecolor','w'),
+                                      alpha=text_box.get('alpha'),edgecolors=text_box.get('edgecolor','k'),
+                                      linewidths=1,zorder=2.9))
+    if len(paths) != 0:
+        collections.append(collection(paths,facecolors=colors,edgecolors='none',zorder=3))
+        
+    return collections
+
+
+class EventRecord(MutableMapping):
+    '''
+    Dictionary-like view of one event stored in an EventStore. Reading 'figure'
+    builds the shapely geometry on first use. Styling fields can be changed,
+    geometry fields are read-only.
+    '''
+    
+    def __init__(self,store,name):
+        self._store = store
+        self._name = name
+        
+    def __getitem__(self,key):
+        return self._store.get_Field(self._name,key)
+    
+    def __setitem__(self,key,value):
+        self._store.set_Field(self._name,key,value)
+        
+    def __delitem__(self,key):
+        raise TypeError("Fields of a stored event can't be deleted.")
+        
+    def __iter__(self):
+        return iter(self._store.get_Fields(self._name))
+    
+    def __len__(self):
+        return len(self._store.get_Fields(self._name))
+    
+    def __repr__(self):
+        return repr(dict(self))
+    
+
+class EventStore(MutableMapping):
+    '''
+    Columnar storage for the events of a Sets_Space: NumPy arrays for centers, axes,
+    angles, areas, bounds and centroids, and one array or list per styling field.
+    Shapely figures are built lazily the first time they are requested.
+    
+    The store behaves like the dictionary of events: store[name] returns an 
+    EventRecord that supports store[name]['figure'], store[name]['alpha'], etc.
+    '''
+    
+    KINDS = ('ellipse','polygon','box')
+    STYLE = ('fill_color','alpha','text','text_loc','fontsize','fontcolor')
+    
+    _COLUMNS = dict(kind=((),np.int8), center=((2,),float), axes=((2,),float), angle=((),float), 
+                    area=((),float), res=((),int), centroid=((2,),float), bounds=((4,),float),
+                    alpha=((),float), text_loc=((2,),float), fontsize=((),float))
+    _LISTS = ('fill_color','text','fontcolor','points','figure')
+    
+    def __init__(self,capacity=16):
+        '''
+        capacity: int, initial number of rows of the arrays. They double in size when full.
+        '''
+        self._names = []
+        self._rows = {}
+        self._cols = {c:np.zeros((capacity,)+shape,dtype=dtype) for c,(shape,dtype) in self._COLUMNS.items()}
+        self._lists = {l:[] for l in self._LISTS}
+        
+    def __len__(self):
+        return len(self._names)
+    
+    def __iter__(self):
+        return iter(list(self._names))
+    
+    def __contains__(self,name):
+        return name in self._rows
+    
+    def __getitem__(self,name):
+        if name not in self._rows:
+            raise KeyError(name)
+        return EventRecord(self,name)
+    
+    def __setitem__(self,name,event):
+        '''
+        Store an event given as a dictionary with the fields used by Sets_Space:
+        kind, figure, area, angle and, for ellipses, center and axes, plus the styling fields.
+        '''
+        style = {s:event[s] for s in self.STYLE}
+        if event.get('kind') == 'ellipse':
+            self.add(name,'ellipse',event['center'],event['angle'],axes=event['axes'],
+                     res=event.get('res',16),figure=event.get('figure'),**style)
+        else: #Any other figure is stored already rotated
+            points = np.asarray(event['figure'].exterior.coords)[:-1]
+            self.add(name,event.get('kind','polygon'),points=points,angle=0,
+                     figure=event['figure'],**style)
+        
+    def __delitem__(self,name):
+        row = self._rows.pop(name)
+        n = len(self._names)
+        
+        for col in self._cols.values(): #Shift the following rows up by one
+            col[row:n-1] = col[row+1:n]
+        for l in self._lists.values():
+            del l[row]
+        del self._names[row]
+        
+        for i in range(row,n-1):
+            self._rows[self._names[i]] = i
+            
+    def add(self,name,kind,loc=None,angle=0,axes=None,res=16,points=None,figure=None,
+            fill_color=None,alpha=1.,text='',text_loc=None,fontsize=10,fontcolor='k'):
+        '''
+        Add one event without building its shapely figure.
+        name: string, name of the event.
+        kind: string, 'ellipse', 'polygon' or 'box'.
+        loc: tuple (x,y), center of an ellipse.
+        angle: float, rotation in degrees. Polygons rotate around their bounding box center.
+        axes: tuple (width,height) of an ellipse.
+        res: int, resolution of the ellipse polygon.
+        points: list or array of the polygon/box vertices.
+        figure: shapely geometry, optional prebuilt figure.
+        The rest are the styling fields of the event. text_loc defaults to the centroid.
+        '''
+        assert name not in self._rows, "Name '%s' already saved. Choose another name."%name
+        
+        if kind == 'ellipse':
+            columns, points = self.ellipse_Columns([loc],[axes[0]],[axes[1]],[angle],res), [None]
+        else:
+            columns, points = polygons_Columns([points],[angle])
+            columns['angle'] = angle
+        
+        if text_loc is not None:
+            columns['text_loc'] = [text_loc]
+        columns.update(alpha=alpha,fontsize=fontsize)
+        
+        self.extend([name],kind,columns,dict(fill_color=[fill_color],text=[text],fontcolor=[fontcolor],
+                                             points=points,figure=[figure]))
+        
+    @staticmethod
+    def ellipse_Columns(loc,width,height,angle,res):
+        '''
+        Returns the dictionary of numeric columns of many ellipses, computed with array operations.
+        loc: array of shape (n, 2). width, height, angle: arrays of shape (n,). res: int.
+        '''
+        from math import pi
+        
+        loc = np.asarray(loc,dtype=float).reshape(-1,2)
+        width, height = np.asarray(width,dtype=float), np.asarray(height,dtype=float)
+        
+        return dict(center=loc, axes=np.stack([width,height],axis=-1), angle=angle, res=res,
+                    area=width*height*pi, centroid=loc, text_loc=loc,
+                    bounds=ellipse_Bounds(loc,width,height,np.asarray(angle,dtype=float)))
+    
+    def extend(self,names,kind,columns,lists):
+        '''
+        Append many events of the same kind at once. Names must be new and unique.
+        names: list of strings.
+        kind: string, 'ellipse', 'polygon' or 'box'.
+        columns: dictionary of column->array (or scalar) with one row per event. 
+                 Columns not given are filled with NaN.
+        lists: dictionary of list name->list with one item per event. Lists not given 
+               are filled with None.
+        '''
+        start = len(self._names)
+        stop = start + len(names)
+        
+        if stop > len(self._cols['kind']): #Grow the arrays to at least double their size
+            size = max(stop,2*len(self._cols['kind']))
+            for c in self._cols:
+                grown = np.zeros((size,)+self._cols[c].shape[1:],dtype=self._cols[c].dtype)
+                grown[:start] = self._cols[c][:start]
+                self._cols[c] = grown
+        
+        self._cols['kind'][start:stop] = self.KINDS.index(kind)
+        for c in self._cols:
+            if c == 'kind':
+                continue
+            elif c in columns:
+                self._cols[c][start:stop] = columns[c]
+            elif self._cols[c].dtype == float:
+                self._cols[c][start:stop] = np.nan
+            
+        for l in self._LISTS:
+            self._lists[l].extend(lists[l] if l in lists else [None]*len(names))
+            
+        self._names.extend(names)
+        self._rows.update(zip(names,range(start,stop)))
+    
+    def get_Fields(self,name):
+        '''
+        Returns a list with the field names of an event.
+        '''
+        fields = ['figure','fill_color','alpha','text','text_loc','fontsize','fontcolor','area','kind','angle']
+        if self._cols['kind'][self._rows[name]] == 0:
+            fields += ['center','axes']
+        return fields
+        
+    def get_Field(self,name,field):
+        '''
+        Returns the value of one field of an event, building the figure if needed.
+        '''
+        row = self._rows[name]
+        
+        if field not in self.get_Fields(name):
+            raise KeyError(field)
+        elif field == 'figure':
+            return self.get_Figure(row)
+        elif field == 'kind':
+            return self.KINDS[self._cols['kind'][row]]
+        elif field in self._lists:
+            return self._lists[field][row]
+        elif self._cols[field].ndim == 2:
+            return tuple(self._cols[field][row].tolist())
+        else:
+            return self._cols[field][row].item()
+        
+    def set_Field(self,name,field,value):
+        '''
+        Change a styling field of an event.
+        '''
+        if field not in self.STYLE:
+            raise TypeError("Field '%s' is read-only. Remove the event and add it again to change it."%field)
+        
+        row = self._rows[name]
+        if field in self._lists:
+            self._lists[field][row] = value
+        else:
+            self._cols[field][row] = value
+    
+    def get_Figure(self,row):
+        '''
+        Returns the shapely figure of the event stored at a row, built on first use.
+        '''
+        figures = self._lists['figure']
+        
+        if figures[row] is None:
+            if self._cols['kind'][row] == 0:
+                figures[row] = ellipse_Figure(self._cols['center'][row],self._cols['axes'][row][0],
+                                              self._cols['axes'][row][1],self._cols['angle'][row],
+                                              self._cols['res'][row])
+            else:
+                figures[row] = sg.Polygon(self._lists['points'][row])
+        return figures[row]
+    
+    def get_Column(self,column):
+        '''
+        Returns a copy of a numeric column with one row per event, in insertion order:
+        'center', 'axes', 'angle', 'area', 'centroid', 'bounds', 'alpha', 'text_loc' or 'fontsize'.
+        '''
+        return self._cols[column][:len(self._names)].copy()
+
+
 class Sets_Space():
-    def __init__(self,name):
+    def __init__(self,name,cache_size=256,columnar=False):
+        '''
+        name: string, name of the space.
+        cache_size: int, maximum number of geometries kept by the LRU cache 
+                    of get_Probability() queries. Default 256.
+        columnar: bool, store the events in an array-backed EventStore instead of
+                  a dictionary of dictionaries. Figures are then built lazily. Default False.
+        '''
         
         self.name = name
         
-        self.events = {}
+        self.events = EventStore() if columnar == True else {}
         
         self.partitions = None
+        self._cells = GridIndex() #Bounding boxes of the partition cells
+        self._next_partition = 1
         
         self.additional_text = {}
+        
+        self.cache_size = cache_size
+        self._query_cache = OrderedDict() #LRU of canonical subexpression key->geometry
+        self._query_stats = dict(hits=0,misses=0)
+        self._index = None #SpatialIndex of the event figures, built on demand
 
         
     def add_Ellipse(self, name, loc, width, height, angle, res, fill_color, alpha,
-                    text,fontsize, fontcolor, text_loc=None):
-        
+                    text,fontsize, fontcolor, text_loc=None, max_error=None):
+        '''
+        Add an ellipse event centered at loc with axes (width, height) rotated by angle degrees.
+        res: int, resolution of the ellipse polygon (4*res segments). If None, it is 
+             chosen from max_error.
+        max_error: float, maximum relative error between the polygon area and the 
+                   analytic area πab stored for the event. The smallest resolution that
+                   meets it is used. Default None, or 0.001 when res is None.
+        '''
         from math import pi
         
         assert name not in self.events, "Name '%s'already saved. Choose another name."%name
         
-        Area = (width)*(height)*pi
-        
-        Shape = shapely.affinity.scale(sg.Point(loc[0],loc[1]).buffer(1,res), width, height)
+        if max_error != None or res == None:
+            res = ellipse_Resolution(0.001 if max_error == None else max_error)
         
-        if text_loc == None:
-            text_loc = (Shape.centroid.x,Shape.centroid.y)
+        if isinstance(self.events,EventStore):
+            self.events.add(name,'ellipse',loc,angle,axes=(width,height),res=res,
+                            fill_color=fill_color,alpha=alpha,text=text,text_loc=text_loc,
+                            fontsize=fontsize,fontcolor=fontcolor)
         else:
-            text_loc = text_loc
-        self.events[name] = dict(figure=shapely.affinity.rotate(
-                                Shape,angle),
-                                fill_color=fill_color, alpha=alpha, text=text, text_loc=text_loc,
-                                fontsize=fontsize,fontcolor=fontcolor,area=Area)
+            Area = (width)*(height)*pi
+
+            Shape = ellipse_Figure(loc,width,height,angle,res)
+
+            if text_loc == None:
+                text_loc = (Shape.centroid.x,Shape.centroid.y)
+            else:
+                text_loc = text_loc
+            self.events[name] = dict(figure=Shape,
+                                    fill_color=fill_color, alpha=alpha, text=text, text_loc=text_loc,
+                                    fontsize=fontsize,fontcolor=fontcolor,area=Area,
+                                    kind='ellipse',center=(loc[0],loc[1]),axes=(width,height),angle=angle)
+        self._events_Changed(added=[name])
     
    
     def add_Polygon(self, name, points, angle, fill_color, alpha, 
@@ -56,11 +890,16 @@ class Sets_Space():
         assert name not in self.events, "Name '%s' already saved. Choose another name."%name            
         if points == None:          
             points = [(0.25,0.25),(0.5,0.75),(0.75,0.25)]
-            Shape = sg.Polygon(points)
             warnings.warn("No points list given for Polygon, using default list: %s." % points)
-                          
-        else:
-            Shape = sg.Polygon([(p[0],p[1]) for p in points])
+        
+        if isinstance(self.events,EventStore):
+            self.events.add(name,'polygon',angle=angle,points=points,
+                            fill_color=fill_color,alpha=alpha,text=text,text_loc=text_loc,
+                            fontsize=fontsize,fontcolor=fontcolor)
+            self._events_Changed(added=[name])
+            return
+            
+        Shape = sg.Polygon([(p[0],p[1]) for p in points])
         
         if text_loc == None:
             text_loc = (Shape.centroid.x,Shape.centroid.y)
@@ -73,7 +912,8 @@ class Sets_Space():
         self.events[name] = dict(figure=shapely.affinity.rotate(Shape,angle),
                                 fill_color=fill_color, alpha=alpha, text=text, 
                                 text_loc=text_loc,fontsize=fontsize,
-                                fontcolor=fontcolor,area=Area)
+                                fontcolor=fontcolor,area=Area,kind='polygon',angle=angle)
+        self._events_Changed(added=[name])
         
         
     def add_Box(self, name, corners, angle, fill_color, alpha, 
@@ -83,13 +923,20 @@ class Sets_Space():
         
         if corners == None:          
             corners = [(0.25,0.25),(0.25,0.75),(0.75,0.75),(0.75,0.25)]
-            Shape = sg.Box(corners)
             warnings.warn("No points list given for Polygon, using default list: %s." % corners)
         
                        
         else:
             assert len(corners) == 4, "Corners parameter has %s corners. A box must have 4 corners."%len(corners)  
-            Shape = sg.Polygon(corners)
+        
+        if isinstance(self.events,EventStore):
+            self.events.add(name,'box',angle=angle,points=corners,
+                            fill_color=fill_color,alpha=alpha,text=text,text_loc=text_loc,
+                            fontsize=fontsize,fontcolor=fontcolor)
+            self._events_Changed(added=[name])
+            return
+            
+        Shape = sg.Polygon(corners)
         
         if text_loc == None:
             text_loc = (Shape.centroid.x,Shape.centroid.y)
@@ -103,7 +950,282 @@ class Sets_Space():
         self.events[name] = dict(figure=shapely.affinity.rotate(Shape,angle),
                                 fill_color=fill_color, alpha=alpha, text=text, 
                                 text_loc=text_loc,fontsize=fontsize,
-                                fontcolor=fontcolor,area=Area) 
+                                fontcolor=fontcolor,area=Area,kind='box',angle=angle)
+        self._events_Changed(added=[name]) 
+        
+    def _check_Batch(self,names,invalid):
+        '''
+        Validate the names of a batch and raise one ValueError that lists every invalid event.
+        names: list of the event names of the batch.
+        invalid: list of tuples (row, reason) already found by the caller.
+        '''
+        seen = set()
+        for row, name in enumerate(names):
+            if name in self.events:
+                invalid.append((row,"name '%s' already saved" % name))
+            elif name in seen:
+                invalid.append((row,"name '%s' repeated in the batch" % name))
+            seen.add(name)
+            
+        if len(invalid) != 0:
+            invalid.sort(key=lambda i: i[0])
+            lines = ['row %s (%s): %s' % (row,names[row],reason) for row, reason in invalid[:20]]
+            if len(invalid) > 20:
+                lines.append('... and %s more.' % (len(invalid)-20))
+            raise ValueError("%s invalid events in the batch, nothing was added:\n" % len(invalid) + '\n'.join(lines))
+        
+    def add_Ellipses_bulk(self, names=None, loc=None, width=None, height=None, angle=None, res=16,
+                          fill_color=None, alpha=None, text=None, fontsize=None, fontcolor=None,
+                          text_loc=None, data=None, max_error=None):
+        '''
+        Add many ellipses in one vectorized pass. Arguments can be lists or numpy arrays
+        with one item per ellipse, or single values shared by all of them (strings and 
+        tuples are single values).
+        names: list of strings, names of the events.
+        loc: array of shape (n, 2) with the centers.
+        width, height: arrays with the axes, as in add_Ellipse().
+        angle: array with the rotations in degrees. Default 0.
+        res: int, resolution shared by all the ellipses. Default 16.
+        fill_color, alpha, text, fontsize, fontcolor: styling. Defaults 'b', 0.5, '', 10 and 'k'.
+        text_loc: array of shape (n, 2). Default is the center of each ellipse.
+        max_error: float, maximum relative area error of the ellipse polygons. If given,
+                   it chooses res as in add_Ellipse(). Default None.
+        data: pandas DataFrame or dictionary of columns used for the arguments left as None.
+              Columns: 'name', 'x', 'y', 'width', 'height', 'angle', 'fill_color', 'alpha', 
+              'text', 'fontsize', 'fontcolor', 'text_x', 'text_y'.
+              
+        The whole batch is validated first: a ValueError lists every invalid event 
+        and no event is added.
+        '''
+        from math import pi
+        
+        if max_error != None:
+            res = ellipse_Resolution(max_error)
+        
+        args = bulk_Arguments(data,dict(names=names,loc=loc,width=width,height=height,angle=angle,
+                                        fill_color=fill_color,alpha=alpha,text=text,fontsize=fontsize,
+                                        fontcolor=fontcolor,text_loc=text_loc),
+                              dict(angle=0.,fill_color='b',alpha=0.5,text='',fontsize=10,fontcolor='k'),
+                              pairs=dict(loc=('x','y'),text_loc=('text_x','text_y')))
+        
+        names = list(args['names'])
+        n = len(names)
+        loc = np.asarray(args['loc'],dtype=float).reshape(-1,2)
+        if len(loc) != n:
+            raise ValueError("Argument 'loc' has %s items, the batch has %s events." % (len(loc),n))
+        width = np.asarray(bulk_Column(args['width'],n,'width'),dtype=float)
+        height = np.asarray(bulk_Column(args['height'],n,'height'),dtype=float)
+        angle = np.asarray(bulk_Column(args['angle'],n,'angle'),dtype=float)
+        style = {s:bulk_Column(args[s],n,s) for s in ('fill_color','alpha','text','fontsize','fontcolor')}
+        
+        invalid = [(row,'center, axes or angle is not a finite number') for row in
+                   np.flatnonzero(~(np.isfinite(loc).all(axis=1) & np.isfinite(width) & 
+                                    np.isfinite(height) & np.isfinite(angle)))]
+        invalid += [(row,'axes must be positive') for row in np.flatnonzero((width <= 0) | (height <= 0))]
+        self._check_Batch(names,invalid)
+        
+        text_loc = loc if args['text_loc'] is None else np.asarray(args['text_loc'],dtype=float).reshape(-1,2)
+        
+        if isinstance(self.events,EventStore):
+            columns = EventStore.ellipse_Columns(loc,width,height,angle,res)
+            columns.update(text_loc=text_loc,alpha=style['alpha'],fontsize=style['fontsize'])
+            self.events.extend(names,'ellipse',columns,dict(fill_color=style['fill_color'],text=style['text'],
+                                                            fontcolor=style['fontcolor']))
+        else:
+            figures = make_Polygons(ellipse_Coords(loc,width,height,angle,res))
+            area = width*height*pi
+            for i in range(n):
+                self.events[names[i]] = dict(figure=figures[i],
+                                             fill_color=style['fill_color'][i], alpha=style['alpha'][i], 
+                                             text=style['text'][i], text_loc=tuple(text_loc[i]),
+                                             fontsize=style['fontsize'][i],fontcolor=style['fontcolor'][i],
+                                             area=area[i],kind='ellipse',center=tuple(loc[i]),
+                                             axes=(width[i],height[i]),angle=angle[i])
+        self._events_Changed(added=names)
+        
+    def add_Polygons_bulk(self, names=None, points=None, angle=None, fill_color=None, alpha=None,
+                          text=None, fontsize=None, fontcolor=None, text_loc=None, kind='polygon', data=None):
+        '''
+        Add many polygons (or boxes) in one vectorized pass. Arguments can be lists or 
+        numpy arrays with one item per polygon, or single values shared by all of them 
+        (strings and tuples are single values).
+        names: list of strings, names of the events.
+        points: list of vertex lists/arrays, or an array of shape (n, vertices, 2).
+        angle: array with the rotations in degrees, around the center of each bounding box. Default 0.
+        fill_color, alpha, text, fontsize, fontcolor: styling. Defaults 'b', 0.5, '', 10 and 'k'.
+        text_loc: array of shape (n, 2). Default is the centroid of each polygon before the rotation.
+        kind: string, 'polygon' or 'box' (boxes must have 4 corners). Default 'polygon'.
+        data: pandas DataFrame or dictionary of columns used for the arguments left as None.
+              Columns: 'name', 'points', 'angle', 'fill_color', 'alpha', 'text', 'fontsize',
+              'fontcolor', 'text_x', 'text_y'.
+              
+        The whole batch is validated first: a ValueError lists every invalid event 
+        and no event is added.
+        '''
+        args = bulk_Arguments(data,dict(names=names,points=points,angle=angle,fill_color=fill_color,
+                                        alpha=alpha,text=text,fontsize=fontsize,fontcolor=fontcolor,
+                                        text_loc=text_loc),
+                              dict(angle=0.,fill_color='b',alpha=0.5,text='',fontsize=10,fontcolor='k'),
+                              pairs=dict(text_loc=('text_x','text_y')))
+        
+        names = list(args['names'])
+        n = len(names)
+        points = [np.asarray(p,dtype=float).reshape(-1,2) for p in bulk_Column(args['points'],n,'points')]
+        angle = np.asarray(bulk_Column(args['angle'],n,'angle'),dtype=float)
+        style = {s:bulk_Column(args[s],n,s) for s in ('fill_color','alpha','text','fontsize','fontcolor')}
+        
+        invalid = []
+        for row, p in enumerate(points):
+            if len(p) < 3:
+                invalid.append((row,'a polygon needs at least 3 points, %s given' % len(p)))
+            elif kind == 'box' and len(p) != 4:
+                invalid.append((row,'a box must have 4 corners, %s given' % len(p)))
+            elif not np.isfinite(p).all():
+                invalid.append((row,'points are not finite numbers'))
+        invalid += [(row,'angle is not a finite number') for row in np.flatnonzero(~np.isfinite(angle))]
+        self._check_Batch(names,invalid)
+        if n == 0: #Nothing to add
+            return
+        
+        columns, rotated = polygons_Columns(points,angle)
+        if args['text_loc'] is not None:
+            columns['text_loc'] = np.asarray(args['text_loc'],dtype=float).reshape(-1,2)
+        
+        if isinstance(self.events,EventStore):
+            columns.update(angle=angle,alpha=style['alpha'],fontsize=style['fontsize'])
+            self.events.extend(names,kind,columns,dict(fill_color=style['fill_color'],text=style['text'],
+                                                       fontcolor=style['fontcolor'],points=rotated))
+        else:
+            figures = make_Polygons(rotated)
+            for i in range(n):
+                self.events[names[i]] = dict(figure=figures[i],
+                                             fill_color=style['fill_color'][i], alpha=style['alpha'][i], 
+                                             text=style['text'][i], text_loc=tuple(columns['text_loc'][i]),
+                                             fontsize=style['fontsize'][i],fontcolor=style['fontcolor'][i],
+                                             area=columns['area'][i],kind=kind,angle=angle[i])
+        self._events_Changed(added=names)
+        
+    def _events_Changed(self,added=()):
+        '''
+        Clear every cached result that depends on the events' geometry and keep
+        the partitions current.
+        added: list with the names of the new events. A single new event updates the
+               partitions incrementally, a batch recomputes them.
+        '''
+        self._query_cache.clear()
+        self._index = None
+        
+        if self.partitions != None and len(added) != 0:
+            if len(added) == 1:
+                self._partition_Add(added[0])
+            else:
+                self.compute_Partitions()
+                
+    def _new_Partition(self,part,events):
+        '''
+        Store a new partition cell with the next free key.
+        '''
+        key = self._next_partition
+        self._next_partition += 1
+        self.partitions[key] = dict(part=part, text='%s' % key, events=events)
+        self._cells.insert(key,part.bounds)
+        
+    def _drop_Partition(self,key):
+        self._cells.remove(key)
+        return self.partitions.pop(key)
+    
+    def _partition_Add(self,name):
+        '''
+        Update the partitions after adding one event: only the cells whose bounding box
+        intersects the event are split, and the parts of the event outside every 
+        other event become new cells.
+        '''
+        figure = self.events[name]['figure']
+        prepared = prep(figure)
+        covered = []
+        
+        for key in self._cells.query(figure.bounds):
+            cell = self.partitions[key]
+            if not prepared.intersects(cell['part']) or prepared.touches(cell['part']):
+                continue
+            covered.append(cell['part'])
+            if prepared.contains(cell['part']): #Whole cell inside the event, no split needed
+                cell['events'] += (name,)
+                continue
+            self._drop_Partition(key)
+            for part in polygon_Parts(cell['part'].intersection(figure)):
+                self._new_Partition(part,cell['events'] + (name,))
+            for part in polygon_Parts(cell['part'].difference(figure)):
+                self._new_Partition(part,cell['events'])
+                
+        rest = figure.difference(unary_union(covered)) if len(covered) != 0 else figure
+        for part in polygon_Parts(rest):
+            self._new_Partition(part,(name,))
+            
+    def _partition_Remove(self,name,figure):
+        '''
+        Update the partitions after removing one event: its cells lose the event and
+        are merged with the neighbouring cells that now have the same events.
+        '''
+        candidates = self._cells.query(figure.bounds)
+        affected = [k for k in candidates if name in self.partitions[k]['events']]
+        labels = set(tuple(e for e in self.partitions[k]['events'] if e != name) for k in affected)
+        #Cells computed by different overlays may leave gaps of rounding size along the 
+        #removed boundary, so neighbours are found and merged with a small tolerance
+        tolerance = 1e-9
+        neighbours = [k for k in candidates if k not in affected and self.partitions[k]['events'] in labels
+                      and self.partitions[k]['part'].distance(figure) < tolerance]
+        
+        groups = {}
+        for key in affected + neighbours:
+            cell = self._drop_Partition(key)
+            label = tuple(e for e in cell['events'] if e != name)
+            groups.setdefault(label,[]).append(cell['part'])
+            
+        for label, parts in groups.items():
+            if len(label) != 0: #Cells only inside the removed event disappear
+                merged = unary_union(parts)
+                if merged.geom_type != 'Polygon': #Close rounding gaps, mitre joins keep the corners
+                    merged = merged.buffer(tolerance,join_style=2).buffer(-tolerance,join_style=2)
+                for part in polygon_Parts(merged):
+                    self._new_Partition(part,label)
+                
+    def remove_Event(self,name):
+        '''
+        Remove an event from the space. If the sets are partitioned, the partitions
+        are updated incrementally.
+        name: string, name of the event.
+        '''
+        figure = self.events[name]['figure']
+        del self.events[name]
+        self._events_Changed()
+        
+        if self.partitions != None:
+            self._partition_Remove(name,figure)
+        
+    def get_Index(self):
+        '''
+        Returns the SpatialIndex (STRtree and prepared geometries) of the event
+        figures, in the order of self.events. It is rebuilt only after the events change.
+        '''
+        if self._index == None:
+            self._index = SpatialIndex([self.events[e]['figure'] for e in self.events])
+        return self._index
+    
+    def get_Overlaps(self):
+        '''
+        Returns a list of tuples (event name, event name) with every pair of
+        events that overlap. Only pairs with intersecting bounding boxes are tested.
+        '''
+        names = list(self.events)
+        return [(names[i],names[j]) for i,j in self.get_Index().overlapping()]
+    
+    def get_Events_at(self,x,y):
+        '''
+        Returns a list with the names of the events that contain the point (x,y).
+        '''
+        names = list(self.events)
+        return [names[i] for i in self.get_Index().containing(sg.Point(x,y))]
         
     def add_Text(self,name,loc,text,fontsize,fontcolor):
         
@@ -116,29 +1238,207 @@ class Sets_Space():
     def get_event_Area(self,ev_name):       
         return self.events[ev_name]['area']
     
-#     def scatter_Points(self):
-#         cos_angle = np.cos(np.radians(180.-angle))
-#         sin_angle = np.sin(np.radians(180.-angle))
-
-#         xc = x - g_ell_center[0]
-#         yc = y - g_ell_center[1]
-
-#         xct = xc * cos_angle - yc * sin_angle
-#         yct = xc * sin_angle + yc * cos_angle 
-
-#         rad_cc = (xct**2/(g_ell_width/2.)**2) + (yct**2/(g_ell_height/2.)**2)
+    def get_Areas(self):
+        '''
+        Returns a numpy array with the area of every event, in the order of self.events.
+        With a columnar store it is read from the arrays, without building figures.
+        '''
+        if isinstance(self.events,EventStore):
+            return self.events.get_Column('area')
+        return np.array([self.events[e]['area'] for e in self.events],dtype=float)
+    
+    def get_Centroids(self):
+        '''
+        Returns a numpy array of shape (events, 2) with the centroid of every event.
+        Ellipse centroids are their centers.
+        '''
+        if isinstance(self.events,EventStore):
+            return self.events.get_Column('centroid')
+        return np.array([self.events[e]['figure'].centroid.coords[0] for e in self.events],
+                        dtype=float).reshape(-1,2)
+    
+    def get_Bounds(self):
+        '''
+        Returns a numpy array of shape (events, 4) with the (minx, miny, maxx, maxy)
+        bounding box of every event. Columnar ellipses use their analytic bounds.
+        '''
+        if isinstance(self.events,EventStore):
+            return self.events.get_Column('bounds')
+        return np.array([self.events[e]['figure'].bounds for e in self.events],dtype=float).reshape(-1,4)
+    
+    def contains_Points(self,ev_name,x,y):
+        '''
+        Vectorized membership test of many points against one event. Ellipses use
+        their analytic equation, polygons and boxes an even-odd test over their edges.
+        ev_name: string, name of the event.
+        x, y: numpy arrays with the point coordinates.
+        
+        Returns a boolean numpy array, True for the points inside the event.
+        '''
+        event = self.events[ev_name]
+        
+        if event.get('kind') == 'ellipse':
+            cos_angle = np.cos(np.radians(event['angle']))
+            sin_angle = np.sin(np.radians(event['angle']))
 
-#         colors_array = []
+            xc = x - event['center'][0]
+            yc = y - event['center'][1]
 
-#         for r in rad_cc:
-#             if r <= 1.:
-#                 # point in ellipse
-#                 colors_array.append('green')
-#             else:
-#                 # point not in ellipse
-#                 colors_array.append('black')
+            xct = xc * cos_angle + yc * sin_angle #Coordinates along the ellipse axes
+            yct = -xc * sin_angle + yc * cos_angle 
 
-#         ax.scatter(x,y,c=colors_array,linewidths=0.3)
+            return (xct/event['axes'][0])**2 + (yct/event['axes'][1])**2 <= 1.
+        
+        return points_in_Polygon(x,y,event['figure'])
+    
+    def sample_probability(self,expr,n=10**6,confidence=0.95,batch=10**6,seed=None):
+        '''
+        Monte Carlo estimate of the probability of a set expression. Uniform points 
+        are drawn in Ω (the unit square of the plot) and tested in vectorized batches.
+        expr: string or list of strings, set expressions over event names, 
+              e.g. 'event_A & ~event_B'. See parse_SetExpression() for the syntax.
+        n: int, number of points. Default 10^6.
+        confidence: float, confidence level of the intervals. Default 0.95.
+        batch: int, number of points tested at once. Default 10^6.
+        seed: int, seed of the random generator. Default None.
+        
+        Returns a dictionary dict(estimate=float, ci=(low,high), std_error=float, n=int).
+        If expr is a list, returns a dictionary of expression->result dictionary.
+        '''
+        from statistics import NormalDist
+        
+        exprs = [expr] if isinstance(expr,str) else list(expr)
+        trees = [parse_SetExpression(e) for e in exprs]
+        for e, tree in zip(exprs,trees):
+            self._check_Expression(tree,e)
+        
+        def evaluate(node,x,y,masks):
+            if node[0] == 'event':
+                if node[1] not in masks:
+                    masks[node[1]] = self.contains_Points(node[1],x,y)
+                return masks[node[1]]
+            elif node[0] == 'omega':
+                return np.ones(x.shape,dtype=bool)
+            elif node[0] == 'not':
+                return ~evaluate(node[1],x,y,masks)
+            elif node[0] == 'and':
+                return evaluate(node[1],x,y,masks) & evaluate(node[2],x,y,masks)
+            elif node[0] == 'or':
+                return evaluate(node[1],x,y,masks) | evaluate(node[2],x,y,masks)
+            else:
+                return evaluate(node[1],x,y,masks) & ~evaluate(node[2],x,y,masks)
+        
+        rand = np.random.RandomState(seed)
+        hits = np.zeros(len(trees))
+        drawn = 0
+        
+        while drawn < n:
+            size = min(batch,n-drawn)
+            x = rand.random_sample(size)
+            y = rand.random_sample(size)
+            masks = {} #Event masks are shared by all the expressions in the batch
+            for i in range(len(trees)):
+                hits[i] += np.count_nonzero(evaluate(trees[i],x,y,masks))
+            drawn += size
+        
+        z = NormalDist().inv_cdf(0.5 + confidence/2)
+        results = {}
+        
+        for e, h in zip(exprs,hits):
+            p = h/n
+            center = (p + z**2/(2*n))/(1 + z**2/n) #Wilson score interval
+            half = z*np.sqrt(p*(1-p)/n + z**2/(4*n**2))/(1 + z**2/n)
+            results[e] = dict(estimate=p, ci=(max(center-half,0.),min(center+half,1.)),
+                              std_error=np.sqrt(p*(1-p)/n), n=n)
+        
+        return results[expr] if isinstance(expr,str) else results
+        
+    def get_Geometry(self,expr):
+        '''
+        Exact geometry of a set expression over the events' figures. Intermediate 
+        unions and intersections are memoized in an LRU cache keyed by the canonical
+        subexpression, so overlapping queries reuse prior work.
+        expr: string, set expression over event names, e.g. 'event_A & (event_B | ~event_C)'.
+              See parse_SetExpression() for the syntax.
+        
+        Returns a shapely geometry.
+        '''
+        return self._expression_Geometry(parse_SetExpression(expr),expr)
+    
+    def _check_Expression(self,tree,expr):
+        '''
+        Raise a ValueError that names every event of a parsed set expression that is not saved.
+        tree: tuple tree returned by parse_SetExpression().
+        expr: string, the expression as given, for the error message.
+        '''
+        unknown = sorted(name for name in expression_Events(tree) if name not in self.events)
+        if len(unknown) != 0:
+            raise ValueError("Unknown events in set expression '%s': %s" 
+                             % (expr,', '.join("'%s'" % name for name in unknown)))
+    
+    def _expression_Geometry(self,tree,expr):
+        '''
+        Helper method of get_Geometry() that evaluates a parsed set expression.
+        tree: tuple tree returned by parse_SetExpression().
+        expr: string, the expression as given, for the error messages.
+        '''
+        self._check_Expression(tree,expr)
+        omega = sg.box(0,0,1,1) #Ω is the unit square of the plot
+        
+        def cached(key,compute):
+            if key in self._query_cache:
+                self._query_cache.move_to_end(key)
+                self._query_stats['hits'] += 1
+                return self._query_cache[key]
+            self._query_stats['misses'] += 1
+            geometry = compute()
+            self._query_cache[key] = geometry
+            if len(self._query_cache) > self.cache_size:
+                self._query_cache.popitem(last=False) #Drop the least recently used
+            return geometry
+        
+        def evaluate(node):
+            key, op, operands = node
+            if op == 'event':
+                return self.events[operands]['figure']
+            elif op == 'omega':
+                return omega
+            elif op == 'not':
+                return cached(key, lambda: omega.difference(evaluate(operands)))
+            elif op == 'diff':
+                return cached(key, lambda: evaluate(operands[0]).difference(evaluate(operands[1])))
+            
+            sym = '&' if op == 'and' else '|'
+            geometry = evaluate(operands[0])
+            for i in range(1,len(operands)): #Every sorted prefix is cached: A&B is reused by A&B&C
+                prefix = '(%s)' % sym.join(c[0] for c in operands[:i+1])
+                if op == 'and':
+                    geometry = cached(prefix, lambda g=geometry,i=i: g.intersection(evaluate(operands[i])))
+                else:
+                    geometry = cached(prefix, lambda g=geometry,i=i: g.union(evaluate(operands[i])))
+            return geometry
+        
+        return evaluate(canonical_SetExpression(tree))
+    
+    def get_Probability(self,expr):
+        '''
+        Exact probability of a set expression: the area of its geometry inside Ω 
+        (the unit square of the plot). Uses the memoized get_Geometry().
+        expr: string, set expression over event names, e.g. 'event_A & event_B'.
+        
+        Returns a float.
+        '''
+        tree = ('and', ('omega',), parse_SetExpression(expr)) #Clipped to Ω
+        
+        return self._expression_Geometry(tree,expr).area
+    
+    def query_cache_Info(self):
+        '''
+        Returns a dictionary with the hits, misses, current size and maximum size
+        of the get_Geometry() LRU cache.
+        '''
+        return dict(hits=self._query_stats['hits'], misses=self._query_stats['misses'],
+                    size=len(self._query_cache), maxsize=self.cache_size)
         
     def events(self,name):
         return self.events[name]['figure']
@@ -153,29 +1453,6 @@ class Sets_Space():
         text_box: text box, a dictionary of the form dict(facecolor=matplotlib color, alpha=int).
         '''
         
-        def cascade_split(to_split,splitters): #Helper function for partitions
-            '''
-            Return a list of all intersections between multiple polygons.
-            to_split: list, polygons or sub-polygons to split
-            splitters: list, polygons used as splitters
-            
-            Returns a list of all the polygons formed by the multiple intersections.
-            '''
-    
-            if len(splitters) == 0:
-                return to_split
-
-            new_to_split = []
-
-            for ts in to_split:
-                f = split(ts,splitters[0].boundary)
-                for i in list(f):
-                    new_to_split.append(i)
-            splitters.remove(splitters[0])
-
-            return cascade_split(new_to_split,splitters)
-
-
         plt.figure(figsize=(figsize,figsize))
         plt.title(title)
         ax = plt.gca()
@@ -183,28 +1460,7 @@ class Sets_Space():
         
         if partition == True:
             
-            #code by @Mike T @ stackexchange: https://gis.stackexchange.com/users/1872/mike-t
-            
-            event_list = [self.events[e]['figure'] for e in self.events]
-            back_event_list = event_list[::-1]
-            
-            index_count = 0
-            polys = []
-
-            for i in combinations(event_list,len(event_list)-1): 
-                c_split = cascade_split([back_event_list[index_count]],list(i))
-                
-                for p in c_split:
-                    if not any(poly.equals(p) for poly in polys):
-                        polys.append(p)
-                index_count += 1
-            
-            partitions = {}
-            
-            for pol in range(len(polys)):
-                partitions[pol+1] = dict(part=polys[pol],
-                                       text='%s' % (pol+1))
-                               
+            partitions = self.get_Partitions() if self.partitions != None else self.compute_Partitions()
 
             for p in partitions:    
                 ax.add_patch(descartes.PolygonPatch(partitions[p]['part'], 
@@ -216,9 +1472,6 @@ class Sets_Space():
                             bbox=text_box,
                             color='blue',
                             horizontalalignment='center')  
-            
-            self.partitions = partitions
-            
                                                    
         else:
             for e in self.events:
@@ -247,9 +1500,139 @@ class Sets_Space():
 
         plt.show()
         
+    def render_Sets(self,title,output=None,fmt='png',figsize=5,dpi=100,partition=False,text_box=None):
+        '''
+        Headless and batched version of plot_Sets() for rendering many diagrams.
+        It draws on an Agg canvas without pyplot or plt.show(): all the figures go in one
+        PatchCollection and all the labels in one PathCollection of text outlines.
+        title: string, title of the chart.
+        output: file path or writable buffer. Default None returns the image as bytes.
+        fmt: string, image format such as 'png' or 'svg'. Default 'png'.
+        figsize: int, size of plot. Default 5.
+        dpi: int, resolution of raster formats. Default 100.
+        partition: bool, choose if the sets are partitioned. Default False.
+        text_box: text box, a dictionary of the form dict(facecolor=matplotlib color, alpha=int).
+        
+        Returns the output, or the image bytes if output is None.
+        '''
+        from io import BytesIO
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.collections import PatchCollection
+        
+        fig = Figure(figsize=(figsize,figsize),dpi=dpi)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        ax.set_title(title)
+        
+        labels = [((0.04,0.96),'$\Omega$',9.5,'k','right')] #(location, text, fontsize, color, alignment)
+        
+        if partition == True:
+            partitions = self.get_Partitions() if self.partitions != None else self.compute_Partitions()
+            patches = [descartes.PolygonPatch(partitions[p]['part'],fc=np.random.rand(3),ec=None,alpha=0.3)
+                       for p in partitions]
+            labels += [(partitions[p]['part'].centroid.coords[0],partitions[p]['text'],10,'blue','center')
+                       for p in partitions]
+        else:
+            patches = [descartes.PolygonPatch(self.events[e]['figure'],fc=self.events[e]['fill_color'],
+                                              ec=None,alpha=self.events[e]['alpha']) for e in self.events]
+            labels += [(self.events[e]['text_loc'],self.events[e]['text'],self.events[e]['fontsize'],
+                        self.events[e]['fontcolor'],'center') for e in self.events]
+            
+        labels += [(t['loc'],t['text'],t['fontsize'],t['fontcolor'],'center') for t in self.additional_text.values()]
+        
+        ax.add_collection(PatchCollection(patches,match_original=True))
+        for collection in label_Collections(fig,ax,labels,text_box):
+            ax.add_collection(collection)
+        
+        ax.set_xlim(0, 1)
+        ax.set_ylim(0, 1)
+        
+        buffer = BytesIO() if output == None else output
+        fig.savefig(buffer,format=fmt)
+        
+        return buffer.getvalue() if output == None else output
+        
+    def compute_Partitions(self):
+        '''
+        Partition the sets without plotting them. Each partition is an atomic region
+        of the space labeled with the events that contain it. Once computed, the
+        partitions are kept current when events are added or removed.
+        
+        Returns the partitions dictionary, also available with get_Partitions().
+        '''
+        names = list(self.events)
+        
+        return self._set_Partitions(partition_Geometries(names,[self.events[e]['figure'] for e in names]))
+    
+    def _set_Partitions(self,partitions):
+        '''
+        Store a partitions dictionary computed for the current events and index its cells.
+        '''
+        self.partitions = partitions
+        
+        self._cells = GridIndex()
+        for key in self.partitions:
+            self._cells.insert(key,self.partitions[key]['part'].bounds)
+        self._next_partition = len(self.partitions) + 1
+        
+        return self.partitions
+        
     def get_Partitions(self):
         if self.partitions == None:
-            raise AttributeError("get_Partitions() failed. The sets are not partitioned.                                  \nUse parameter 'partition' = True in plot_Sets().")
+            raise AttributeError("get_Partitions() failed. The sets are not partitioned.                                  \nUse parameter 'partition' = True in plot_Sets() or call compute_Partitions().")
         else:
             return self.partitions
-            
\ No newline at end of file
+            
+
+
+def compute_Partitions_many(spaces, workers=None, chunksize=1):
+    '''
+    Compute the partitions of many independent Sets_Space instances in a process pool,
+    without plotting. The figures are sent to the workers as WKB and the partitions
+    come back the same way, then each space is updated as in compute_Partitions().
+    spaces: iterable of Sets_Space.
+    workers: int, number of processes. Default None uses every core. With 1 the
+             partitions are computed in this process.
+    chunksize: int, number of spaces sent to a worker in each task. Default 1.
+    
+    Yields (space, partitions) as soon as each space is done, not in input order.
+    '''
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from shapely import wkb
+    
+    spaces = list(spaces)
+    jobs = []
+    for position, space in enumerate(spaces):
+        names = list(space.events)
+        jobs.append((position, names, [wkb.dumps(space.events[e]['figure']) for e in names]))
+    
+    if workers == 1:
+        for job in jobs:
+            position, parts = _partition_Worker(job)
+            yield spaces[position], _load_Partitions(spaces[position],parts)
+        return
+    
+    chunks = [jobs[i:i+chunksize] for i in range(0,len(jobs),max(1,chunksize))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_partition_Chunk,chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            for position, parts in future.result():
+                yield spaces[position], _load_Partitions(spaces[position],parts)
+
+
+def _partition_Chunk(jobs):
+    '''
+    Helper function that runs _partition_Worker() over a list of jobs in one task.
+    '''
+    return [_partition_Worker(job) for job in jobs]
+
+
+def _load_Partitions(space,parts):
+    '''
+    Helper function that rebuilds the partitions returned by a worker and stores them in space.
+    '''
+    from shapely import wkb
+    
+    return space._set_Partitions({key: dict(part=wkb.loads(part), text='%s' % key, events=events)
+                                  for key, part, events in parts})